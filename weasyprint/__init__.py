@@ -125,20 +125,24 @@ class HTML(Resource):
         self.url_fetcher = url_fetcher
 
     def _ua_stylesheet(self):
-        from .html import HTML5_UA_STYLESHEET
-        return [HTML5_UA_STYLESHEET]
+        from .html import get_ua_stylesheet
+        return [get_ua_stylesheet()]
 
-    def _get_document(self, stylesheets, enable_hinting, ua_stylesheets=None):
+    def _get_document(self, stylesheets, enable_hinting, ua_stylesheets=None,
+                      prefetch_workers=None):
         if ua_stylesheets is None:
             ua_stylesheets = self._ua_stylesheet()
         from .document import Document
-        return Document(
+        document = Document(
             self.root_element, enable_hinting, self.url_fetcher,
             user_stylesheets=[css if isinstance(css, CSS) else CSS(guess=css)
                               for css in stylesheets or []],
             user_agent_stylesheets=ua_stylesheets)
+        if prefetch_workers:
+            document.prefetch(prefetch_workers)
+        return document
 
-    def write_pdf(self, target=None, stylesheets=None):
+    def write_pdf(self, target=None, stylesheets=None, prefetch_workers=None):
         """Render the document to PDF.
 
         :param target:
@@ -146,13 +150,18 @@ class HTML(Resource):
         :param stylesheets:
             a list of user stylsheets, as :class:`CSS` objects, filenames,
             URLs, or file-like objects
+        :param prefetch_workers:
+            if given, fetch stylesheets and images in this number of
+            threads before rendering instead of one at a time.
         :returns:
             If :obj:`target` is :obj:`None`, a PDF byte string.
         """
-        document = self._get_document(stylesheets, enable_hinting=False)
+        document = self._get_document(stylesheets, enable_hinting=False,
+                                      prefetch_workers=prefetch_workers)
         return document.write_pdf(target)
 
-    def write_png(self, target=None, stylesheets=None, resolution=None):
+    def write_png(self, target=None, stylesheets=None, resolution=None,
+                  workers=None, prefetch_workers=None):
         """Render the document to a single PNG image.
 
         :param target:
@@ -160,26 +169,40 @@ class HTML(Resource):
         :param stylesheets:
             a list of user stylsheets, as :class:`CSS` objects, filenames,
             URLs, or file-like objects
+        :param workers:
+            the number of threads drawing pages at the same time.
+        :param prefetch_workers:
+            if given, fetch stylesheets and images in this number of
+            threads before rendering instead of one at a time.
         :returns:
             If :obj:`target` is :obj:`None`, a PNG byte string.
         """
-        document = self._get_document(stylesheets, enable_hinting=True)
-        return document.write_png(target, resolution)
+        document = self._get_document(stylesheets, enable_hinting=True,
+                                      prefetch_workers=prefetch_workers)
+        return document.write_png(target, resolution, workers)
 
     def get_png_pages(self, stylesheets=None, resolution=None,
+                      workers=None, prefetch_workers=None,
                       _with_document=False):
         """Render the document to multiple PNG images, one per page.
 
         :param stylesheets:
             a list of user stylsheets, as :class:`CSS` objects, filenames,
             URLs, or file-like objects
+        :param workers:
+            the number of threads drawing and encoding pages at the same
+            time. Images are still generated in page order.
+        :param prefetch_workers:
+            if given, fetch stylesheets and images in this number of
+            threads before rendering instead of one at a time.
         :returns:
             A generator of ``(width, height, png_bytes)`` tuples, one for
             each page, in order.
 
         """
-        document = self._get_document(stylesheets, enable_hinting=True)
-        pages = document.get_png_pages(resolution)
+        document = self._get_document(stylesheets, enable_hinting=True,
+                                      prefetch_workers=prefetch_workers)
+        pages = document.get_png_pages(resolution, workers)
         if _with_document:
             return document, pages
         else:
@@ -196,34 +219,31 @@ class CSS(Resource):
     """
     def __init__(self, guess=None, filename=None, url=None, file_obj=None,
                  string=None, encoding=None, base_url=None,
-                 url_fetcher=default_url_fetcher, _check_mime_type=False):
-        from .css import PARSER, preprocess_stylesheet
+                 url_fetcher=default_url_fetcher, _check_mime_type=False,
+                 _cache_directory=None):
+        from .css import parse_stylesheet
 
         source_type, source, base_url, protocol_encoding = _select_source(
             guess, filename, url, file_obj, string, tree=None,
             base_url=base_url, url_fetcher=url_fetcher,
             check_css_mime_type=_check_mime_type,)
 
-        kwargs = dict(linking_encoding=encoding,
-                      protocol_encoding=protocol_encoding)
-        if source_type == 'string':
-            if isinstance(source, bytes):
-                method = 'parse_stylesheet_bytes'
-            else:
-                # unicode, no encoding
-                method = 'parse_stylesheet'
-                kwargs.clear()
-        else:
-            # file_obj or filename
-            method = 'parse_stylesheet_file'
-        # TODO: do not keep this?
-        self.stylesheet = getattr(PARSER, method)(source, **kwargs)
-        self.base_url = base_url
+        if source_type == 'filename':
+            with open(source, 'rb') as fd:
+                source = fd.read()
+        elif source_type == 'file_obj':
+            source = source.read()
+        # else: string, bytes or unicode (no encoding)
         medium = 'print'  # for @media
-        self.rules = list(preprocess_stylesheet(
-            medium, base_url, self.stylesheet.rules, url_fetcher))
-        for error in self.stylesheet.errors:
-            LOGGER.warn(error)
+        # TODO: do not keep self.stylesheet?
+        self.stylesheet, self.rules, self.rule_index = parse_stylesheet(
+            source, base_url, medium, url_fetcher,
+            linking_encoding=encoding, protocol_encoding=protocol_encoding,
+            cache_directory=_cache_directory)
+        self.base_url = base_url
+        if self.stylesheet is not None:  # None if loaded from the cache
+            for error in self.stylesheet.errors:
+                LOGGER.warn(error)
 
 
 
@@ -0,0 +1,80 @@
+# coding: utf8
+"""
+    weasyprint.cache
+    ----------------
+
+    Bounded caches that can be shared by all documents in a process.
+
+    :copyright: Copyright 2011-2012 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals
+
+import threading
+
+
+class LRUCache(object):
+    """A thread-safe cache that evicts the least recently used entries.
+
+    :param max_entries: The maximum number of entries.
+    :param max_size:
+        The maximum total size of the entries, or ``None`` for no limit.
+        The size of each entry is given to :meth:`set`, usually in bytes.
+
+    ``hits`` and ``misses`` count the results of :meth:`get`.
+
+    """
+    def __init__(self, max_entries=128, max_size=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> [value, size, last_used]
+        self._entries = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the value for ``key`` and mark it as recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._clock += 1
+            entry[2] = self._clock
+            return entry[0]
+
+    def set(self, key, value, size=0):
+        """Add an entry, evicting others as needed to stay in the limits."""
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= old_entry[1]
+            if self.max_size is not None and size > self.max_size:
+                # Would evict everything else and still not fit.
+                return
+            self._clock += 1
+            self._entries[key] = [value, size, self._clock]
+            self.size += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_size is not None and self.size > self.max_size):
+                self._evict()
+
+    def _evict(self):
+        entries = self._entries
+        key = min(entries, key=lambda key: entries[key][2])
+        self.size -= entries.pop(key)[1]
+
+    def clear(self):
+        """Remove all entries. Hit and miss counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -21,7 +21,9 @@ if sys.version_info[0] >= 3:
     from urllib.parse import (
         urljoin, urlsplit, quote, unquote, unquote_to_bytes, parse_qs,
         urlencode, uses_relative as urlparse_uses_relative)
-    from urllib.request import urlopen, Request, pathname2url
+    from urllib.request import urlopen, Request, pathname2url, getproxies
+    from urllib.error import HTTPError
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
     from array import array
     from base64 import (decodebytes as base64_decode,
                         encodebytes as base64_encode)
@@ -33,12 +35,15 @@ if sys.version_info[0] >= 3:
     izip = zip
 
 
-    def urlopen_contenttype(url):
+    def get_content_type(info):
+        """Return (mime_type, encoding) from HTTP headers"""
+        return info.get_content_type(), info.get_param('charset')
+
+
+    def urlopen_contenttype(url, **kwargs):
         """Return (file_obj, mime_type, encoding)"""
-        result = urlopen(url)
-        info = result.info()
-        mime_type = info.get_content_type()
-        charset = info.get_param('charset')
+        result = urlopen(url, **kwargs)
+        mime_type, charset = get_content_type(result.info())
         return result, mime_type, charset
 
 
@@ -56,8 +61,9 @@ else:
     # Python 2
     from urlparse import (urljoin, urlsplit, parse_qs,
                           uses_relative as urlparse_uses_relative)
-    from urllib2 import urlopen, Request
-    from urllib import pathname2url, quote, unquote, urlencode
+    from urllib2 import urlopen, Request, HTTPError
+    from urllib import pathname2url, quote, unquote, urlencode, getproxies
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
     from array import array as _array
     from itertools import izip
     from base64 import (decodestring as base64_decode,
@@ -73,12 +79,15 @@ else:
         return _array(typecode.encode('ascii'), initializer)
 
 
-    def urlopen_contenttype(url):
+    def get_content_type(info):
+        """Return (mime_type, encoding) from HTTP headers"""
+        return info.gettype(), info.getparam('charset')
+
+
+    def urlopen_contenttype(url, **kwargs):
         """Return (file_obj, mime_type, encoding)"""
-        result = urlopen(url)
-        info = result.info()
-        mime_type = info.gettype()
-        charset = info.getparam('charset')
+        result = urlopen(url, **kwargs)
+        mime_type, charset = get_content_type(result.info())
         return result, mime_type, charset
 
 
@@ -43,6 +43,12 @@
 from __future__ import division, unicode_literals
 
 import re
+import os
+import sys
+import pickle
+import hashlib
+import tempfile
+import collections
 
 import tinycss
 import cssselect
@@ -50,15 +56,23 @@ import lxml.etree
 
 from . import properties
 from . import computed_values
+from . import validation
 from .validation import preprocess_declarations
 from ..urls import get_url_attribute
 from ..logger import LOGGER
-from ..compat import iteritems, urljoin
-from .. import CSS
+from ..stats import count
+from ..compat import iteritems, urljoin, basestring
+from .. import CSS, VERSION
 
 
 PARSER = tinycss.make_parser('page3')
 
+#: Process-wide cache for parsed and preprocessed stylesheets, shared by all
+#: :class:`~weasyprint.CSS` objects. Disabled (``None``) by default, set it
+#: to a :class:`~weasyprint.cache.LRUCache` to enable it. Sizes are those of
+#: the stylesheet sources, in bytes.
+STYLESHEET_CACHE = None
+
 
 # Reject anything not in here:
 PSEUDO_ELEMENTS = (None, 'before', 'after', 'first-line', 'first-letter')
@@ -79,16 +93,34 @@ RE_INITIAL_NOT_COMPUTED = re.compile(
     '^(display|border_[a-z]+_(width|color))$').match
 
 
+class ComputedValues(dict):
+    """Flat values shared by many :class:`StyleDict` objects.
+
+    These dicts are never modified once filled.
+
+    """
+    # The style of anonymous children, see StyleDict.inherit_from
+    inherited_style = None
+
+
 class StyleDict(object):
     """A mapping (dict-like) that allows attribute access to values.
 
     Allow eg. ``style.font_size`` instead of ``style['font-size']``.
 
-    :param parent: if given, should be a mapping. Values missing from this
-                   dict will be looked up in the parent dict. Setting a value
-                   in this dict masks any value in the parent.
+    :param data: values set on this style, copied.
+    :param parent: if given, should be a flat mapping. Values missing from
+                   this dict will be looked up in the parent dict, which is
+                   shared and must not be modified. Setting a value in this
+                   dict masks any value in the parent.
+
+    Computed styles have all their values in a shared
+    :class:`ComputedValues` parent, so looking up a value takes at most two
+    dict lookups however many times the style was copied.
 
     """
+    __slots__ = ('_storage', '_parent', 'anonymous', '_inherited_style')
+
     def __init__(self, data=None, parent=None):
         if data is None:
             data = {}
@@ -99,6 +131,8 @@ class StyleDict(object):
         # work around our own __setattr__
         object.__setattr__(self, '_storage', data)
         object.__setattr__(self, '_parent', parent)
+        object.__setattr__(self, 'anonymous', False)
+        object.__setattr__(self, '_inherited_style', None)
 
     def __getitem__(self, key):
         storage = self._storage
@@ -109,6 +143,9 @@ class StyleDict(object):
 
     def __setitem__(self, key, value):
         self._storage[key] = value
+        if self._inherited_style is not None:
+            # Inherited from the previous value, outdated
+            object.__setattr__(self, '_inherited_style', None)
 
     def updated_copy(self, other):
         copy = self.copy()
@@ -124,41 +161,50 @@ class StyleDict(object):
     def copy(self):
         """Copy the ``StyleDict``.
 
-        Create a new StyleDict with this one as the parent. This is a cheap
-        "copy-on-write". Modifications in the copy will not affect
-        the original, but modifications in the original *may* affect the
-        copy.
+        This is a cheap "copy-on-write": the parent is shared and only
+        the values set on this style are copied. Modifications in the copy
+        will not affect the original, and the other way around.
 
         """
-        if self._storage:
-            parent = self
-        else:
-            parent = self._parent
-        style = type(self)(parent=parent)
+        style = type(self)(self._storage or None, self._parent)
         if self.anonymous:
             object.__setattr__(style, 'anonymous', True)
         return style
 
     def inherit_from(self):
-        """Return a new StyleDict with inherited properties from this one.
+        """Return a StyleDict with inherited properties from this one.
 
         Non-inherited properties get their initial values.
         This is the styles for an anonymous box.
+
+        The result is computed once and shared by all anonymous children:
+        do not modify it, modify a :meth:`copy` instead.
+
         """
+        parent = self._parent
+        if not self._storage and isinstance(parent, ComputedValues):
+            # Share the result with all styles with the same values.
+            style = parent.inherited_style
+            if style is None:
+                style = parent.inherited_style = self._compute_inherited()
+        else:
+            style = self._inherited_style
+            if style is None:
+                style = self._compute_inherited()
+                object.__setattr__(self, '_inherited_style', style)
+        return style
+
+    def _compute_inherited(self):
         style = computed_from_cascaded(cascaded={}, parent_style=self,
             # Only used by non-inherited properties. eg `content: attr(href)`
             element=None)
         object.__setattr__(style, 'anonymous', True)
         return style
 
-    # Default values, may be overriden on instances
-    anonymous = False
 
-
-def find_stylesheets(element_tree, medium, url_fetcher):
-    """Yield the stylesheets in ``element_tree``.
-
-    The output order is the same as the source order.
+def find_stylesheet_elements(element_tree, medium):
+    """Yield the ``<style>`` and ``<link rel=stylesheet href=...>`` elements
+    in ``element_tree`` that apply to ``medium``, in source order.
 
     """
     for element in element_tree.iter():
@@ -172,6 +218,22 @@ def find_stylesheets(element_tree, medium, url_fetcher):
         media = [media_type.strip() for media_type in media_attr.split(',')]
         if not evaluate_media_query(media, medium):
             continue
+        if element.tag == 'style':
+            yield element
+        elif element.tag == 'link' and element.get('href'):
+            rel = element.get('rel', '').split()
+            if 'stylesheet' not in rel or 'alternate' in rel:
+                continue
+            yield element
+
+
+def find_stylesheets(element_tree, medium, url_fetcher):
+    """Yield the stylesheets in ``element_tree``.
+
+    The output order is the same as the source order.
+
+    """
+    for element in find_stylesheet_elements(element_tree, medium):
         if element.tag == 'style':
             # Content is text that is directly in the <style> element, not its
             # descendants
@@ -184,10 +246,7 @@ def find_stylesheets(element_tree, medium, url_fetcher):
             css = CSS(string=content, base_url=element.base_url,
                       url_fetcher=url_fetcher)
             yield css
-        elif element.tag == 'link' and element.get('href'):
-            rel = element.get('rel', '').split()
-            if 'stylesheet' not in rel or 'alternate' in rel:
-                continue
+        else:
             href = get_url_attribute(element, 'href')
             if href is not None:
                 yield CSS(url=href, url_fetcher=url_fetcher,
@@ -256,14 +315,32 @@ def add_declaration(cascaded_styles, prop_name, prop_values, weight, element,
         style[prop_name] = prop_values, weight
 
 
+def add_declarations(cascaded_styles, declarations, origin, specificity,
+                     element, pseudo_type=None):
+    """Add the declarations of a rule matching an element."""
+    for name, values, importance in declarations:
+        precedence = declaration_precedence(origin, importance)
+        weight = (precedence, specificity)
+        add_declaration(
+            cascaded_styles, name, values, weight, element, pseudo_type)
+
+
 def set_computed_styles(cascaded_styles, computed_styles,
-                        element, parent, pseudo_type=None):
+                        element, parent, pseudo_type=None, interned=None,
+                        shared_styles=None):
     """Set the computed values of styles to ``element``.
 
     Take the properties left by ``apply_style_rule`` on an element or
     pseudo-element and assign computed values with respect to the cascade,
     declaration priority (ie. ``!important``) and selector specificity.
 
+    If ``interned`` is a dict, share the values of equal styles,
+    see :func:`intern_style`.
+
+    If ``shared_styles`` is a dict, reuse the values computed for
+    an element with the same parent style and cascaded values,
+    see :func:`style_sharing_key`.
+
     """
     if parent is None:
         parent_style = None
@@ -271,25 +348,74 @@ def set_computed_styles(cascaded_styles, computed_styles,
         parent_style = computed_styles[parent, None]
 
     cascaded = cascaded_styles.get((element, pseudo_type), {})
+    if shared_styles is not None:
+        key = style_sharing_key(cascaded, parent_style, pseudo_type)
+        if key is not None:
+            values = shared_styles.get(key)
+            if values is not None:
+                count('shared_computed_styles')
+                computed_styles[element, pseudo_type] = StyleDict(
+                    parent=values)
+                return
+    else:
+        key = None
+
     style = computed_from_cascaded(
         element, cascaded, parent_style, pseudo_type)
+    if interned is not None:
+        style = intern_style(style, interned)
+    if key is not None:
+        shared_styles[key] = style._parent
     computed_styles[element, pseudo_type] = style
 
 
+def style_sharing_key(cascaded, parent_style, pseudo_type):
+    """Return a key for the computed values of an element, or ``None``.
+
+    Elements with the same key have the same computed values: they have
+    the same parent style and the same cascaded values. Keys are only
+    valid while these styles and values are alive.
+
+    Return ``None`` when the computed values also depend on the element
+    itself: for the root element and with ``attr()`` values.
+
+    """
+    if parent_style is None or parent_style._storage:
+        return None
+    if 'anchor' in cascaded or 'link' in cascaded:
+        return None
+    if 'content' in cascaded:
+        content, _weight = cascaded['content']
+        if not isinstance(content, basestring) and any(
+                type_ == 'attr' for type_, _value in content):
+            return None
+    # Lists are not hashable, use their identity. They usually come from
+    # the same declaration.
+    key = (id(parent_style._parent), pseudo_type, frozenset(
+        (name, (list, id(value)) if isinstance(value, list) else value)
+        for name, (value, _weight) in iteritems(cascaded)))
+    try:
+        hash(key)
+    except TypeError:
+        # Other unhashable values
+        return None
+    return key
+
+
 def computed_from_cascaded(element, cascaded, parent_style, pseudo_type=None):
     """Get a dict of computed style mixed from parent and cascaded styles."""
     if not cascaded and parent_style is not None:
         # Fast path for anonymous boxes:
         # no cascaded style, only implicitly initial or inherited values.
-        computed = StyleDict(parent=properties.INITIAL_VALUES)
+        values = ComputedValues(properties.INITIAL_VALUES)
         for name in properties.INHERITED:
-            computed[name] = parent_style[name]
+            values[name] = parent_style[name]
         # border-*-style is none, so border-width computes to zero.
         # Other than that, properties that would need computing are
         # border-*-color, but they do not apply.
         for side in ('top', 'bottom', 'left', 'right'):
-            computed['border_%s_width' % side] = 0
-        return computed
+            values['border_%s_width' % side] = 0
+        return StyleDict(parent=values)
 
     # Handle inheritance and initial values
     specified = StyleDict()
@@ -320,15 +446,276 @@ def computed_from_cascaded(element, cascaded, parent_style, pseudo_type=None):
 
         specified[name] = value
 
-    return computed_values.compute(
+    computed = computed_values.compute(
         element, pseudo_type, specified, computed, parent_style)
+    # Move all values to a flat parent, so that copies are cheap.
+    return StyleDict(parent=ComputedValues(computed._storage))
+
+
+# Names of the values in computed styles, in a fixed order
+STYLE_VALUE_NAMES = sorted(properties.INITIAL_VALUES) + [
+    '_weasy_specified_display']
+
+
+def intern_style(style, interned):
+    """Return ``style``, or an equal style that shares its values with
+    other styles.
+
+    :param style:
+        A StyleDict returned by :func:`computed_from_cascaded`.
+    :param interned:
+        A dict of keys -> :class:`ComputedValues`, filled with the values
+        of new styles.
+
+    """
+    values = style._parent
+    # Lists are not hashable, use their identity. They usually are
+    # inherited or come from the same declaration.
+    key = tuple([
+        (list, id(value)) if isinstance(value, list) else value
+        for value in map(values.get, STYLE_VALUE_NAMES)])
+    try:
+        shared_values = interned.setdefault(key, values)
+    except TypeError:
+        # Other unhashable values
+        return style
+    if shared_values is values:
+        return style
+    # A new StyleDict: the style of each element may be modified.
+    return StyleDict(parent=shared_values)
+
+
+# XPath steps from an element matching the right-hand side of a combinator
+# to elements matching its left-hand side.
+COMBINATOR_AXES = {
+    ' ': 'ancestor::%s',
+    '>': 'parent::%s',
+    '~': 'preceding-sibling::%s',
+    '+': 'preceding-sibling::*[1]/self::%s',
+}
 
 
 class Selector(object):
-    def __init__(self, specificity, pseudo_element, match):
+    """A compiled selector.
+
+    For style rules, ``match`` takes an element and returns a non-empty list
+    if the element matches. ``index_key`` is the ``(kind, value)`` used by
+    :class:`RuleIndex`, see :func:`selector_index_key`.
+
+    For @page rules, ``match`` takes a document and returns a list of page
+    types.
+
+    """
+    def __init__(self, specificity, pseudo_element, match, index_key=None):
         self.specificity = specificity
         self.pseudo_element = pseudo_element
         self.match = match
+        self.index_key = index_key
+
+    # Compiled XPath expressions and closures can not be pickled: keep
+    # the source of the expression or the page types instead.
+    def __getstate__(self):
+        if isinstance(self.match, lxml.etree.XPath):
+            match = 'xpath', self.match.path
+        else:
+            match = 'page', self.match(None)
+        return self.specificity, self.pseudo_element, match, self.index_key
+
+    def __setstate__(self, state):
+        self.specificity, self.pseudo_element, match, self.index_key = state
+        kind, value = match
+        if kind == 'xpath':
+            self.match = lxml.etree.XPath(value)
+        else:
+            self.match = page_types_matcher(value)
+
+
+def page_types_matcher(page_types):
+    """Return a ``match`` function for @page selectors."""
+    return lambda _document: page_types
+
+
+class ElementTranslator(cssselect.HTMLTranslator):
+    """Translate selectors to conditions on a single element.
+
+    cssselect (before 0.9) translates structural pseudo-classes with
+    ``position()`` and ``last()`` from the parent of elements, but the
+    context of a ``self::`` step is a single element where ``position()`` is
+    always 1. Count siblings instead.
+
+    """
+    def sibling_index(self, xpath, axis, of_type):
+        """Return an XPath expression for the 1-based index of the element
+        among its siblings (of the same type if ``of_type``), counted from
+        the end for the ``following-sibling`` axis.
+
+        """
+        if of_type:
+            if xpath.element == '*':
+                raise cssselect.ExpressionError(
+                    'Type pseudo-classes on * are not implemented')
+            node_test = xpath.element
+        else:
+            node_test = '*'
+        return 'count(%s::%s) + 1' % (axis, node_test)
+
+    def xpath_nth_child_function(self, xpath, function, last=False,
+                                 add_name_test=True):
+        try:
+            a, b = cssselect.parser.parse_series(function.arguments)
+        except ValueError:
+            raise cssselect.ExpressionError(
+                "Invalid series: '%r'" % function.arguments)
+        index = self.sibling_index(
+            xpath, 'following-sibling' if last else 'preceding-sibling',
+            of_type=not add_name_test)
+        # The index is a * n + b for some n >= 0
+        if a == 0:
+            condition = '%s = %i' % (index, b)
+        else:
+            condition = '(%s - %i) mod %i = 0 and %s %s %i' % (
+                index, b, a, index, '>=' if a > 0 else '<=', b)
+        return xpath.add_condition('parent::* and ' + condition)
+
+    def xpath_nth_last_child_function(self, xpath, function):
+        return self.xpath_nth_child_function(xpath, function, last=True)
+
+    def xpath_nth_of_type_function(self, xpath, function):
+        return self.xpath_nth_child_function(
+            xpath, function, add_name_test=False)
+
+    def xpath_nth_last_of_type_function(self, xpath, function):
+        return self.xpath_nth_child_function(
+            xpath, function, last=True, add_name_test=False)
+
+    def xpath_first_child_pseudo(self, xpath):
+        return xpath.add_condition('parent::* and %s = 1' % (
+            self.sibling_index(xpath, 'preceding-sibling', False)))
+
+    def xpath_last_child_pseudo(self, xpath):
+        return xpath.add_condition('parent::* and %s = 1' % (
+            self.sibling_index(xpath, 'following-sibling', False)))
+
+    def xpath_first_of_type_pseudo(self, xpath):
+        return xpath.add_condition('parent::* and %s = 1' % (
+            self.sibling_index(xpath, 'preceding-sibling', True)))
+
+    def xpath_last_of_type_pseudo(self, xpath):
+        return xpath.add_condition('parent::* and %s = 1' % (
+            self.sibling_index(xpath, 'following-sibling', True)))
+
+    def xpath_only_child_pseudo(self, xpath):
+        return xpath.add_condition('parent::* and %s = 1 and %s = 1' % (
+            self.sibling_index(xpath, 'preceding-sibling', False),
+            self.sibling_index(xpath, 'following-sibling', False)))
+
+    def xpath_only_of_type_pseudo(self, xpath):
+        return xpath.add_condition('parent::* and %s = 1 and %s = 1' % (
+            self.sibling_index(xpath, 'preceding-sibling', True),
+            self.sibling_index(xpath, 'following-sibling', True)))
+
+
+def element_xpath(translator, tree):
+    """Return an XPath step selecting elements that match a parsed selector.
+
+    XPath expressions from cssselect select all matching elements from
+    the root of a document. Here, combinators are followed from right to left
+    so that ``'self::' + step`` can be evaluated on a single element.
+
+    """
+    if isinstance(tree, cssselect.parser.CombinedSelector):
+        expr = translator.xpath(tree.subselector)
+        expr.add_condition(COMBINATOR_AXES[tree.combinator] % element_xpath(
+            translator, tree.selector))
+    else:
+        expr = translator.xpath(tree)
+    if expr.path == '*/':
+        # Only elements that have a parent, eg. for :nth-child()
+        expr.add_condition('parent::*')
+    elif expr.path:  # pragma: no cover
+        raise cssselect.ExpressionError('Unexpected XPath %s' % expr)
+    if expr.condition:
+        return '%s[%s]' % (expr.element, expr.condition)
+    else:
+        return expr.element
+
+
+def selector_index_key(tree):
+    """Return the key for a parsed selector in a :class:`RuleIndex`.
+
+    This is ``('id', id)``, ``('class', class_name)`` or ``('tag', name)``
+    for the rightmost compound selector, in this order of preference, or
+    ``None`` if the selector can match any element.
+
+    """
+    if isinstance(tree, cssselect.parser.CombinedSelector):
+        tree = tree.subselector
+    key = None
+    while tree is not None:
+        if isinstance(tree, cssselect.parser.Hash):
+            return 'id', tree.id
+        elif isinstance(tree, cssselect.parser.Class):
+            if key is None:
+                key = 'class', tree.class_name
+        elif isinstance(tree, cssselect.parser.Element):
+            if key is None and tree.element and not tree.namespace:
+                key = 'tag', tree.element.lower()
+            break
+        # The parts of a compound selector are nested in .selector.
+        # (Not .subselector: the argument of :not() is not required.)
+        tree = getattr(tree, 'selector', None)
+    return key
+
+
+class RuleIndex(object):
+    """Style rules of a stylesheet, indexed for matching.
+
+    Selectors are bucketed by the id, class or tag name of their rightmost
+    compound selector (see :func:`selector_index_key`) so that only a few
+    candidate selectors need to be tested on each element.
+
+    :param rules: the ``(rule, selector_list, declarations)`` tuples of
+                  a :class:`CSS` object.
+
+    """
+    def __init__(self, rules):
+        self.buckets = {}
+        # Selectors without a key, to be tested on every element
+        self.universal = []
+        #: ``(selector_list, declarations)`` for @page and margin rules.
+        self.page_rules = []
+        order = 0
+        for rule, selector_list, declarations in rules:
+            if rule.at_keyword:
+                self.page_rules.append((selector_list, declarations))
+                continue
+            for selector in selector_list:
+                # Keep the source order to break ties in the cascade.
+                entry = order, selector, declarations
+                order += 1
+                if selector.index_key is None:
+                    self.universal.append(entry)
+                else:
+                    self.buckets.setdefault(
+                        selector.index_key, []).append(entry)
+
+    def match(self, element):
+        """Yield ``(selector, declarations)`` for selectors matching
+        ``element``, in source order.
+
+        """
+        buckets = self.buckets
+        candidates = list(self.universal)
+        candidates.extend(buckets.get(('tag', element.tag), ()))
+        element_id = element.get('id')
+        if element_id:
+            candidates.extend(buckets.get(('id', element_id), ()))
+        for class_name in set(element.get('class', '').split()):
+            candidates.extend(buckets.get(('class', class_name), ()))
+        candidates.sort()
+        for _order, selector, declarations in candidates:
+            if selector.match(element):
+                yield selector, declarations
 
 
 def preprocess_stylesheet(medium, base_url, rules, url_fetcher):
@@ -336,7 +723,7 @@ def preprocess_stylesheet(medium, base_url, rules, url_fetcher):
     in a document.
 
     """
-    selector_to_xpath = cssselect.HTMLTranslator().selector_to_xpath
+    translator = ElementTranslator()
     for rule in rules:
         if not rule.at_keyword:
             declarations = list(preprocess_declarations(
@@ -348,7 +735,9 @@ def preprocess_stylesheet(medium, base_url, rules, url_fetcher):
                         Selector(
                             (0,) + selector.specificity(),
                             selector.pseudo_element,
-                            lxml.etree.XPath(selector_to_xpath(selector)))
+                            lxml.etree.XPath('self::' + element_xpath(
+                                translator, selector.parsed_tree)),
+                            selector_index_key(selector.parsed_tree))
                         for selector in cssselect.parse(selector_string)
                     ]
                     for selector in selector_list:
@@ -387,9 +776,7 @@ def preprocess_stylesheet(medium, base_url, rules, url_fetcher):
             declarations = list(preprocess_declarations(
                 base_url, rule.declarations))
 
-            # Use a double lambda to have a closure that holds page_types
-            match = (lambda page_types: lambda _document: page_types)(
-                PAGE_PSEUDOCLASS_TARGETS[pseudo_class])
+            match = page_types_matcher(PAGE_PSEUDOCLASS_TARGETS[pseudo_class])
             specificity = rule.specificity
 
             if declarations:
@@ -405,15 +792,160 @@ def preprocess_stylesheet(medium, base_url, rules, url_fetcher):
                     yield margin_rule, selector_list, declarations
 
 
-def get_all_computed_styles(element_tree, medium, url_fetcher,
-                            user_stylesheets=None, ua_stylesheets=None):
-    """Compute all the computed styles of all elements in ``element_tree``
+# See get_cache_version(). Computed on first use.
+_cache_version = []
+
+
+def get_cache_version():
+    """Return a string identifying the code that preprocessed rules in cache
+    files depend on, or ``None`` if it can not be found.
+
+    Pickled rules depend on the versions of WeasyPrint, Python, tinycss,
+    cssselect and lxml, and on the code doing the preprocessing, which may
+    change without a new version of WeasyPrint (eg. in a development tree).
+
+    """
+    if not _cache_version:
+        versions = [VERSION, sys.version_info[:2],
+                    getattr(tinycss, 'VERSION', None),
+                    getattr(cssselect, '__version__', None),
+                    lxml.etree.LXML_VERSION]
+        digest = hashlib.sha1(repr(versions).encode('utf8'))
+        try:
+            for module in (sys.modules[__name__], properties, validation):
+                filename = module.__file__
+                if filename.endswith(('.pyc', '.pyo')):
+                    filename = filename[:-1]
+                with open(filename, 'rb') as fd:
+                    digest.update(fd.read())
+        except (IOError, OSError):
+            version = None
+        else:
+            version = digest.hexdigest()
+        _cache_version.append(version)
+    return _cache_version[0]
+
+
+#: Stands for tinycss rules in preprocessed rules loaded from the disk.
+PrecompiledRule = collections.namedtuple(
+    'PrecompiledRule', ['at_keyword', 'line', 'column'])
+
+
+def read_stylesheet_cache(filename):
+    """Return preprocessed rules from a cache file, or ``None``."""
+    try:
+        with open(filename, 'rb') as fd:
+            return pickle.load(fd)
+    except Exception:
+        # Missing, unreadable or from an incompatible version
+        return None
+
+
+def write_stylesheet_cache(filename, rules):
+    """Save preprocessed rules to a cache file, if possible."""
+    rules = [(PrecompiledRule(rule.at_keyword, rule.line, rule.column),
+              selector_list, declarations)
+             for rule, selector_list, declarations in rules]
+    try:
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Write to a temporary file first, other processes may be reading.
+        fd, temp_filename = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as file_obj:
+                pickle.dump(rules, file_obj, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_filename, filename)
+        except Exception:
+            os.remove(temp_filename)
+            raise
+    except (IOError, OSError) as exc:
+        LOGGER.warn('Could not write the stylesheet cache %s: %s',
+                    filename, exc)
+
+
+def parse_stylesheet(source, base_url, medium, url_fetcher,
+                     linking_encoding=None, protocol_encoding=None,
+                     cache_directory=None):
+    """Parse and preprocess the source of a stylesheet.
+
+    :param source: a byte string, or Unicode if no decoding is needed.
+    :param cache_directory:
+        if not ``None``, a directory where the preprocessed rules are saved
+        to and loaded from. Only used for stylesheets without @import.
+    :returns: ``(stylesheet, rules, rule_index)``, a tinycss stylesheet
+              (``None`` when loaded from ``cache_directory``), the list of
+              preprocessed rules and their :class:`RuleIndex`.
+
+    If :obj:`STYLESHEET_CACHE` is enabled, stylesheets with the same source,
+    ``base_url``, ``medium`` and encodings are only processed once.
+    Stylesheets imported with @import are fetched again every time but
+    also go through the cache.
+
+    """
+    cache = STYLESHEET_CACHE
+    is_bytes = isinstance(source, bytes)
+    entry = None
+    if cache is not None or cache_directory is not None:
+        source_bytes = source if is_bytes else source.encode('utf8')
+        digest = hashlib.sha1(source_bytes).hexdigest()
+        key = (digest, is_bytes, base_url, medium, linking_encoding,
+               protocol_encoding)
+        if cache is not None:
+            entry = cache.get(key)
+        if cache_directory is not None and get_cache_version() is None:
+            cache_directory = None
+        if entry is None and cache_directory is not None:
+            # Pickled data depends on the versions of the code.
+            cache_filename = os.path.join(
+                cache_directory, 'stylesheet-%s-%s.pickle' % (
+                    VERSION, hashlib.sha1(repr(
+                        (get_cache_version(), key)).encode('utf8')
+                    ).hexdigest()))
+            rules = read_stylesheet_cache(cache_filename)
+            if rules is not None:
+                entry = None, [], rules, RuleIndex(rules)
+                if cache is not None:
+                    cache.set(key, entry, len(source_bytes))
+
+    if entry is None:
+        if is_bytes:
+            stylesheet = PARSER.parse_stylesheet_bytes(
+                source, linking_encoding=linking_encoding,
+                protocol_encoding=protocol_encoding)
+        else:
+            stylesheet = PARSER.parse_stylesheet(source)
+        # @import rules are only valid at the start of a stylesheet.
+        import_rules = [rule for rule in stylesheet.rules
+                        if rule.at_keyword == '@import']
+        rules = list(preprocess_stylesheet(
+            medium, base_url, [rule for rule in stylesheet.rules
+                               if rule.at_keyword != '@import'],
+            url_fetcher))
+        entry = stylesheet, import_rules, rules, RuleIndex(rules)
+        if cache is not None:
+            cache.set(key, entry, len(source_bytes))
+        if cache_directory is not None and not import_rules:
+            write_stylesheet_cache(cache_filename, rules)
+
+    stylesheet, import_rules, rules, rule_index = entry
+    if import_rules:
+        rules = list(preprocess_stylesheet(
+            medium, base_url, import_rules, url_fetcher)) + rules
+        rule_index = RuleIndex(rules)
+    return stylesheet, rules, rule_index
+
+
+def get_cascaded_styles(element_tree, medium, url_fetcher,
+                        user_stylesheets=None, ua_stylesheets=None):
+    """Find the cascaded styles of all elements in ``element_tree``
     for the media type ``medium``.
 
     Do everything from finding author stylesheets in the given HTML document
     to parsing and applying them.
 
-    Return a dict of (element, pseudo element type) -> StyleDict instance.
+    Return a dict of (element, pseudo element type) -> cascaded values,
+    to be given to :class:`StyleFor`.
 
     """
     author_stylesheets = list(find_stylesheets(
@@ -431,26 +963,37 @@ def get_all_computed_styles(element_tree, medium, url_fetcher,
     #             http://www.w3.org/TR/CSS21/cascade.html#cascading-order
     cascaded_styles = {}
 
-    for sheets, origin in (
+    origins = (
         # Order here is not important ('origin' is).
         # Use this order for a regression test
         (ua_stylesheets or [], 'user agent'),
         (author_stylesheets, 'author'),
         (user_stylesheets or [], 'user'),
-    ):
+    )
+
+    # Walk the tree once and only test the candidate selectors from the
+    # rule index of each stylesheet on each element.
+    for element in element_tree.iter():
+        if not isinstance(element.tag, basestring):
+            # Comments and processing instructions
+            continue
+        for sheets, origin in origins:
+            for sheet in sheets:
+                for selector, declarations in sheet.rule_index.match(element):
+                    add_declarations(
+                        cascaded_styles, declarations, origin,
+                        selector.specificity, element,
+                        selector.pseudo_element)
+
+    for sheets, origin in origins:
         for sheet in sheets:
-            for _rule, selector_list, declarations in sheet.rules:
+            for selector_list, declarations in sheet.rule_index.page_rules:
                 for selector in selector_list:
-                    specificity = selector.specificity
-                    pseudo_type = selector.pseudo_element
-                    for element in selector.match(element_tree):
-                        for name, values, importance in declarations:
-                            precedence = declaration_precedence(
-                                origin, importance)
-                            weight = (precedence, specificity)
-                            add_declaration(
-                                cascaded_styles, name, values, weight,
-                                element, pseudo_type)
+                    for page_type in selector.match(element_tree):
+                        add_declarations(
+                            cascaded_styles, declarations, origin,
+                            selector.specificity, page_type,
+                            selector.pseudo_element)
 
     specificity = (1, 0, 0, 0)
     for element, declarations, base_url in find_style_attributes(element_tree):
@@ -460,45 +1003,108 @@ def get_all_computed_styles(element_tree, medium, url_fetcher,
             weight = (precedence, specificity)
             add_declaration(cascaded_styles, name, values, weight, element)
 
-    # keys: (element, pseudo_element_type), like cascaded_styles
-    # values: StyleDict objects:
-    #     keys: property name as a string
-    #     values: a PropertyValue-like object
-    computed_styles = {}
+    return cascaded_styles
 
-    # First, computed styles for "real" elements *in tree order*
-    # Tree order is important so that parents have computed styles before
-    # their children, for inheritance.
 
-    # Iterate on all elements, even if there is no cascaded style for them.
-    for element in element_tree.iter():
-        set_computed_styles(cascaded_styles, computed_styles, element,
-                            parent=element.getparent())
+class StyleFor(object):
+    """Computed styles of the elements in ``element_tree``, computed
+    when first needed.
 
+    Call this object with an element or page type and an optional
+    pseudo-element type to get a :class:`StyleDict`, or ``None`` for
+    pseudo-elements that have no style.
 
-    # Then computed styles for @page.
+    Elements that are never asked for, such as those in
+    ``display: none`` subtrees, are never computed.
 
-    # Iterate on all possible page types, even if there is no cascaded style
-    # for them.
-    for page_type in PAGE_PSEUDOCLASS_TARGETS[None]:
-        set_computed_styles(cascaded_styles, computed_styles, page_type,
-        # @page inherits from the root element:
-        # http://lists.w3.org/Archives/Public/www-style/2012Jan/1164.html
-                            parent=element_tree)
-
-    # Then computed styles for pseudo elements, in any order.
-    # Pseudo-elements inherit from their associated element so they come
-    # last. Do them in a second pass as there is no easy way to iterate
-    # on the pseudo-elements for a given element with the current structure
-    # of cascaded_styles. (Keys are (element, pseudo_type) tuples.)
+    """
+    def __init__(self, element_tree, cascaded_styles):
+        self.element_tree = element_tree
+        self.cascaded_styles = cascaded_styles
+        # keys: (element, pseudo_element_type), like cascaded_styles
+        # values: StyleDict objects:
+        #     keys: property name as a string
+        #     values: a PropertyValue-like object
+        self.computed_styles = {}
+        # Equal styles share their values, see intern_style()
+        self._interned = {}
+        # See style_sharing_key()
+        self._shared_styles = {}
+
+    def __call__(self, element, pseudo_type=None):
+        computed_styles = self.computed_styles
+        style = computed_styles.get((element, pseudo_type))
+        if style is not None:
+            return style
 
-    # Only iterate on pseudo-elements that have cascaded styles. (Others
-    # might as well not exist.)
-    for element, pseudo_type in cascaded_styles:
         if pseudo_type:
-            set_computed_styles(cascaded_styles, computed_styles,
-                                element, pseudo_type=pseudo_type,
-                                # The pseudo-element inherits from the element.
-                                parent=element)
+            # Only pseudo-elements that have cascaded styles have a style.
+            # (Others might as well not exist.)
+            if (element, pseudo_type) not in self.cascaded_styles:
+                return None
+            # The pseudo-element inherits from the element.
+            parent = element
+            self(parent)
+        elif isinstance(element, basestring):
+            # @page inherits from the root element:
+            # http://lists.w3.org/Archives/Public/www-style/2012Jan/1164.html
+            parent = self.element_tree
+            self(parent)
+        else:
+            # Parents need computed styles before their children, for
+            # inheritance. Compute missing ancestors from the root.
+            parent = element.getparent()
+            ancestors = []
+            ancestor = parent
+            while ancestor is not None and (
+                    ancestor, None) not in computed_styles:
+                ancestors.append(ancestor)
+                ancestor = ancestor.getparent()
+            for ancestor in reversed(ancestors):
+                self._set_computed_styles(ancestor, ancestor.getparent())
+
+        self._set_computed_styles(element, parent, pseudo_type)
+        return computed_styles[element, pseudo_type]
+
+    def _set_computed_styles(self, element, parent, pseudo_type=None):
+        set_computed_styles(
+            self.cascaded_styles, self.computed_styles, element, parent,
+            pseudo_type, interned=self._interned,
+            # Page types are computed like root elements
+            shared_styles=None if isinstance(element, basestring)
+            else self._shared_styles)
+
+    def compute_all(self):
+        """Compute the styles of all elements, pages and pseudo-elements.
+
+        Return a dict of (element, pseudo element type) -> StyleDict.
+
+        """
+        # Iterate on all elements, even if there is no cascaded style for
+        # them. Parents come before their children.
+        for element in self.element_tree.iter():
+            self(element)
+
+        # Iterate on all possible page types, even if there is no cascaded
+        # style for them.
+        for page_type in PAGE_PSEUDOCLASS_TARGETS[None]:
+            self(page_type)
+
+        for element, pseudo_type in self.cascaded_styles:
+            if pseudo_type:
+                self(element, pseudo_type)
+
+        return self.computed_styles
+
 
-    return computed_styles
+def get_all_computed_styles(element_tree, medium, url_fetcher,
+                            user_stylesheets=None, ua_stylesheets=None):
+    """Compute all the computed styles of all elements in ``element_tree``
+    for the media type ``medium``.
+
+    Return a dict of (element, pseudo element type) -> StyleDict instance.
+
+    """
+    return StyleFor(element_tree, get_cascaded_styles(
+        element_tree, medium, url_fetcher, user_stylesheets, ua_stylesheets)
+    ).compute_all()
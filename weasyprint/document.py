@@ -16,19 +16,94 @@ import io
 import sys
 import math
 import shutil
+import tempfile
+import functools
+import collections
+from multiprocessing.pool import ThreadPool
 
 import cairo
 
-from .css import get_all_computed_styles
+from .css import get_cascaded_styles, StyleFor
 from .formatting_structure.build import build_formatting_structure
 from . import layout
 from . import draw
 from . import images
 from . import pdf
+from . import png
+from . import urls
+from .prefetch import PrefetchingURLFetcher, find_tree_urls, find_style_urls
+from .logger import LOGGER
+from .stats import Stats, count
+
+
+#: PDF files written to non-seekable targets are kept in memory up to this
+#: size in bytes, then in a temporary file on disk.
+PDF_SPOOL_MAX_SIZE = 10 * 1024 * 1024
+
+
+def is_updatable(file_obj):
+    """Return whether ``file_obj`` can be written to, read and seeked
+    from its start, as needed by :class:`pdf.PDFFile`.
+
+    """
+    try:
+        if hasattr(file_obj, 'seekable'):
+            # io module objects
+            if not (file_obj.readable() and file_obj.seekable()):
+                return False
+        elif '+' not in getattr(file_obj, 'mode', ''):
+            # Python 2 file objects, or anything we do not know about.
+            return False
+        return file_obj.tell() == 0
+    except (AttributeError, IOError, OSError, ValueError):
+        return False
+
+
+def get_png_size(page, px_resolution):
+    """Return the size in pixels of a page drawn at this resolution."""
+    return (int(math.ceil(page.margin_width() * px_resolution)),
+            int(math.ceil(page.margin_height() * px_resolution)))
+
+
+def map_pages(function, pages, workers=None):
+    """Like ``map(function, pages)``, but lazy and in up to ``workers``
+    threads if more than 1.
+
+    Laid out pages can not be sent to other processes (they hold Pango
+    layouts), but cairo releases the GIL while drawing and encoding.
+    Pages share Pango layouts (text boxes of a paragraph split across pages,
+    fixed boxes) and image patterns: drawing never changes them, see
+    :func:`text.copy_line` and :func:`images.get_cairo_pattern`.
+
+    """
+    if not workers or workers <= 1:
+        for page in pages:
+            yield function(page)
+        return
+    # Only keep a few pages ahead of the consumer, to bound memory use.
+    pool = ThreadPool(workers)
+    try:
+        pending = collections.deque()
+        for page in pages:
+            pending.append(pool.apply_async(function, (page,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
 
 
 class Document(object):
-    """Abstract output document."""
+    """Abstract output document.
+
+    Different documents can be rendered at the same time in parallel
+    threads. A given document should only be used by one thread at a time,
+    but can draw its pages in ``workers`` threads. Objects shared between
+    documents (images, fonts, text attributes) are never changed when
+    drawing.
+
+    """
     def __init__(self, element_tree, enable_hinting, url_fetcher,
                  user_stylesheets, user_agent_stylesheets):
         self.element_tree = element_tree  #: lxml HtmlElement object
@@ -37,16 +112,68 @@ class Document(object):
         self.user_stylesheets = user_stylesheets
         self.user_agent_stylesheets = user_agent_stylesheets
         self._image_cache = {}
+        # Failures of other fetchers are not shared with other documents.
+        self._cache_image_failures = url_fetcher is urls.default_url_fetcher
+        self._connection_pool = None
+        if (url_fetcher is urls.default_url_fetcher
+                and urls.CONNECTION_POOL is None):
+            # Keep HTTP connections open while rendering this document,
+            # see _close_connections.
+            self._connection_pool = urls.ConnectionPool()
+            url_fetcher = functools.partial(
+                url_fetcher, connection_pool=self._connection_pool)
+        if urls.FETCH_TIME_BUDGET is not None:
+            url_fetcher = urls.limit_fetch_time(
+                url_fetcher, urls.FETCH_TIME_BUDGET)
+        self._url_fetcher = PrefetchingURLFetcher(url_fetcher)
+        #: :class:`stats.Stats` for the rendering of this document
+        self.stats = Stats()
+        self._style_for = None
         self._computed_styles = None
         self._formatting_structure = None
         self._pages = None
 
+    def _get_style_for(self):
+        if self._style_for is None:
+            with self.stats.stage('cascaded_styles'):
+                self._style_for = StyleFor(self.element_tree,
+                    get_cascaded_styles(
+                        self.element_tree, url_fetcher=self._url_fetcher,
+                        user_stylesheets=self.user_stylesheets,
+                        ua_stylesheets=self.user_agent_stylesheets,
+                        medium='print'))
+        return self._style_for
+
     # This is mostly useful to make pseudo_type optional.
     def style_for(self, element, pseudo_type=None):
         """
         Convenience method to get the computed styles for an element.
+
+        Styles are computed on demand: elements that are not rendered,
+        eg. in ``display: none`` subtrees, are never computed.
         """
-        return self.computed_styles.get((element, pseudo_type))
+        return self._get_style_for()(element, pseudo_type)
+
+    def prefetch(self, workers=None):
+        """Fetch the stylesheets and images of the document concurrently.
+
+        This is optional and only useful before rendering: otherwise each
+        resource is fetched when first needed, one at a time. Stylesheets
+        and images linked from the HTML are fetched first, then images
+        in the cascaded styles. Stylesheets imported with ``@import`` are
+        still fetched while parsing the stylesheet importing them.
+
+        :param workers:
+            the maximum number of resources fetched at the same time,
+            :obj:`prefetch.DEFAULT_WORKERS` by default.
+
+        """
+        with self.stats.stage('prefetch'):
+            self._url_fetcher.prefetch(
+                find_tree_urls(self.element_tree, 'print'), workers)
+            style_for = self._get_style_for()
+            self._url_fetcher.prefetch(
+                find_style_urls(style_for.cascaded_styles), workers)
 
     @property
     def computed_styles(self):
@@ -54,13 +181,13 @@ class Document(object):
         dict of (element, pseudo_element_type) -> StyleDict
         StyleDict: a dict of property_name -> PropertyValue,
                    also with attribute access
+
+        Styles are computed for all elements when this is first accessed.
         """
         if self._computed_styles is None:
-            self._computed_styles = get_all_computed_styles(
-                self.element_tree, url_fetcher=self.url_fetcher,
-                user_stylesheets=self.user_stylesheets,
-                ua_stylesheets=self.user_agent_stylesheets,
-                medium='print')
+            style_for = self._get_style_for()
+            with self.stats.stage('computed_styles'):
+                self._computed_styles = style_for.compute_all()
         return self._computed_styles
 
     @property
@@ -70,8 +197,10 @@ class Document(object):
         for the root element.
         """
         if self._formatting_structure is None:
-            self._formatting_structure = build_formatting_structure(
-                self.element_tree, self.style_for, self.get_image_from_uri)
+            with self.stats.stage('formatting_structure'):
+                self._formatting_structure = build_formatting_structure(
+                    self.element_tree, self.style_for,
+                    self.get_image_from_uri)
         return self._formatting_structure
 
     @property
@@ -81,69 +210,154 @@ class Document(object):
         for every box.
         """
         if self._pages is None:
-            context = layout.LayoutContext(
-                self.enable_hinting, self.style_for, self.get_image_from_uri)
-            self._pages = list(layout.layout_document(
-                context, self.formatting_structure))
+            with self.stats.stage('pages'):
+                context = layout.LayoutContext(self.enable_hinting,
+                    self.style_for, self.get_image_from_uri)
+                try:
+                    self._pages = list(layout.layout_document(
+                        context, self.formatting_structure))
+                finally:
+                    self._close_connections()
+                count('pages_laid_out', len(self._pages))
         return self._pages
 
+    def _close_connections(self):
+        """Close the idle HTTP connections of this document.
+
+        Called after layout and rendering: most resources are fetched by
+        then, connections are opened again if needed.
+
+        """
+        if self._connection_pool is not None:
+            self._connection_pool.close()
+
+    def _finish_rendering(self):
+        """Free the resources only needed until the pages are drawn."""
+        # Background images are fetched when drawing: prefetched results
+        # are only unused after that.
+        self._url_fetcher.clear()
+        self._close_connections()
+
     def get_image_from_uri(self, uri, type_=None):
         return images.get_image_from_uri(
-            self._image_cache, self.url_fetcher, uri, type_)
+            self._image_cache, self._url_fetcher, uri, type_,
+            self._cache_image_failures)
 
-    def get_png_surfaces(self, resolution=None):
-        """Yield (width, height, image_surface) tuples, one for each page."""
-        px_resolution = (resolution or 96) / 96
-        for page in self.pages:
-            width = int(math.ceil(page.margin_width() * px_resolution))
-            height = int(math.ceil(page.margin_height() * px_resolution))
+    def _draw_png_page(self, page, px_resolution):
+        with self.stats.stage('get_png_surfaces'):
+            width, height = get_png_size(page, px_resolution)
             surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
             context = draw.make_cairo_context(
                 surface, self.enable_hinting, self.get_image_from_uri)
             context.scale(px_resolution, px_resolution)
             draw.draw_page(page, context)
-            yield width, height, surface
+        return width, height, surface
 
-    def get_png_pages(self, resolution=None):
-        """Yield (width, height, png_bytes) tuples, one for each page."""
-        for width, height, surface in self.get_png_surfaces(resolution):
+    def get_png_surfaces(self, resolution=None, workers=None):
+        """Yield (width, height, image_surface) tuples, one for each page.
+
+        :param workers:
+            If more than 1, draw this number of pages at the same time
+            in separate threads. Results are still yielded in page order.
+
+        """
+        px_resolution = (resolution or 96) / 96
+        try:
+            for result in map_pages(
+                    lambda page: self._draw_png_page(page, px_resolution),
+                    self.pages, workers):
+                yield result
+        finally:
+            self._finish_rendering()
+        LOGGER.debug('Rendering statistics: %s', self.stats)
+
+    def get_png_pages(self, resolution=None, workers=None):
+        """Yield (width, height, png_bytes) tuples, one for each page.
+
+        :param workers: see :meth:`get_png_surfaces`.
+
+        """
+        px_resolution = (resolution or 96) / 96
+        # Encode in the same worker thread as drawing.
+        def draw_png_page(page):
+            width, height, surface = self._draw_png_page(page, px_resolution)
             file_obj = io.BytesIO()
             surface.write_to_png(file_obj)
-            yield width, height, file_obj.getvalue()
+            return width, height, file_obj.getvalue()
+        try:
+            for result in map_pages(draw_png_page, self.pages, workers):
+                yield result
+        finally:
+            self._finish_rendering()
+        LOGGER.debug('Rendering statistics: %s', self.stats)
 
-    def write_png(self, target=None, resolution=None):
-        """Write a single PNG image."""
-        surfaces = list(self.get_png_surfaces(resolution))
-        if len(surfaces) == 1:
-            _, _, surface = surfaces[0]
-        else:
-            total_height = sum(height for _, height, _ in surfaces)
-            max_width = max(width for width, _, _ in surfaces)
-            surface = cairo.ImageSurface(
-                cairo.FORMAT_ARGB32, max_width, total_height)
-            context = cairo.Context(surface)
-            pos_y = 0
-            for width, height, page_surface in surfaces:
-                pos_x = (max_width - width) // 2
-                context.set_source_surface(page_surface, pos_x, pos_y)
-                context.paint()
-                pos_y += height
+    def write_png(self, target=None, resolution=None, workers=None):
+        """Write a single PNG image.
 
-        if target is None:
-            target = io.BytesIO()
-            surface.write_to_png(target)
-            return target.getvalue()
-        else:
+        Multiple pages are stacked vertically and written progressively:
+        only a few page surfaces are kept in memory at a time.
+
+        :param workers: see :meth:`get_png_surfaces`.
+
+        """
+        if len(self.pages) == 1:
+            [(_, _, surface)] = self.get_png_surfaces(resolution)
+            if target is None:
+                target = io.BytesIO()
+                surface.write_to_png(target)
+                return target.getvalue()
             if sys.version_info[0] < 3 and isinstance(target, unicode):
                 # py2cairo 1.8 does not support unicode filenames.
                 target = target.encode(sys.getfilesystemencoding())
             surface.write_to_png(target)
+            return
+
+        px_resolution = (resolution or 96) / 96
+        sizes = [get_png_size(page, px_resolution) for page in self.pages]
+        max_width = max(width for width, _ in sizes)
+        total_height = sum(height for _, height in sizes)
+        surfaces = self.get_png_surfaces(resolution, workers)
+        if target is None:
+            file_obj = io.BytesIO()
+            png.write_png(file_obj, surfaces, max_width, total_height)
+            return file_obj.getvalue()
+        elif hasattr(target, 'write'):
+            png.write_png(target, surfaces, max_width, total_height)
+        else:
+            with open(target, 'wb') as file_obj:
+                png.write_png(file_obj, surfaces, max_width, total_height)
 
     def write_pdf(self, target=None):
-        """Write a single PNG image."""
-        # Use an in-memory buffer. We will need to seek for metadata
-        # TODO: avoid this if target can seek? Benchmark first.
-        file_obj = io.BytesIO()
+        """Write a PDF document.
+
+        The PDF is written directly to ``target`` if it is a filename or
+        a file object that can be read and seeked from its start, then
+        metadata is appended in place. Other targets (eg. pipes) get a copy
+        of a temporary file that only stays in memory while it is small.
+
+        """
+        with self.stats.stage('write_pdf'):
+            if target is None:
+                file_obj = io.BytesIO()
+                self._write_pdf_to(file_obj)
+                result = file_obj.getvalue()
+            elif not hasattr(target, 'write'):
+                with open(target, 'w+b') as file_obj:
+                    self._write_pdf_to(file_obj)
+            elif is_updatable(target):
+                target.truncate()
+                self._write_pdf_to(target)
+            else:
+                with tempfile.SpooledTemporaryFile(
+                        PDF_SPOOL_MAX_SIZE) as file_obj:
+                    self._write_pdf_to(file_obj)
+                    file_obj.seek(0)
+                    shutil.copyfileobj(file_obj, target)
+        LOGGER.debug('Rendering statistics: %s', self.stats)
+        if target is None:
+            return result
+
+    def _write_pdf_to(self, file_obj):
         # We’ll change the surface size for each page
         surface = cairo.PDFSurface(file_obj, 1, 1)
         px_to_pt = pdf.PX_TO_PT
@@ -156,15 +370,7 @@ class Document(object):
             draw.draw_page(page, context)
             surface.show_page()
         surface.finish()
+        self._finish_rendering()
 
-        pdf.write_pdf_metadata(self.pages, file_obj)
-
-        if target is None:
-            return file_obj.getvalue()
-        else:
-            file_obj.seek(0)
-            if hasattr(target, 'write'):
-                shutil.copyfileobj(file_obj, target)
-            else:
-                with open(target, 'wb') as fd:
-                    shutil.copyfileobj(file_obj, fd)
+        with self.stats.stage('pdf_metadata'):
+            pdf.write_pdf_metadata(self.pages, file_obj)
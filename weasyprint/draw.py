@@ -20,7 +20,8 @@ import cairo
 
 from .formatting_structure import boxes
 from .stacking import StackingContext
-from .text import show_first_line
+from .text import show_line
+from .images import get_cairo_pattern
 from .compat import xrange
 
 # Map values of the image-rendering property to cairo FILTER values:
@@ -350,15 +351,13 @@ def draw_background(context, style, painting_area, positioning_area):
             context.clip()
 
         if bg_repeat == 'no-repeat':
-            # The same image/pattern may have been used
-            # in a repeating background.
-            pattern.set_extend(cairo.EXTEND_NONE)
+            extend = cairo.EXTEND_NONE
         else:
-            pattern.set_extend(cairo.EXTEND_REPEAT)
-        # TODO: de-duplicate this with draw_replacedbox()
-        pattern.set_filter(IMAGE_RENDERING_TO_FILTER[style.image_rendering])
+            extend = cairo.EXTEND_REPEAT
         context.scale(scale_x, scale_y)
-        context.set_source(pattern)
+        context.set_source(get_cairo_pattern(
+            pattern, context, extend,
+            IMAGE_RENDERING_TO_FILTER[style.image_rendering]))
         context.paint()
 
 
@@ -664,12 +663,9 @@ def draw_replacedbox(context, box):
             context.rectangle(0, 0, width, height)
             context.clip()
             context.scale(scale_width, scale_height)
-            # The same image/pattern may have been used in a
-            # repeating background.
-            pattern.set_extend(cairo.EXTEND_NONE)
-            pattern.set_filter(IMAGE_RENDERING_TO_FILTER[
-                box.style.image_rendering])
-            context.set_source(pattern)
+            context.set_source(get_cairo_pattern(
+                pattern, context, cairo.EXTEND_NONE,
+                IMAGE_RENDERING_TO_FILTER[box.style.image_rendering]))
             context.paint()
     # Make sure `pattern` is garbage collected. If a surface for a SVG image
     # is still alive by the time we call show_page(), cairo will rasterize
@@ -713,7 +709,8 @@ def draw_text(context, textbox):
 
     context.move_to(textbox.position_x, textbox.position_y + textbox.baseline)
     context.set_source_rgba(*textbox.style.color)
-    show_first_line(context, textbox.pango_layout, context.enable_hinting)
+    show_line(context, textbox.pango_layout, textbox.pango_line_index,
+              textbox.style, context.enable_hinting)
     values = textbox.style.text_decoration
     if 'overline' in values:
         draw_text_decoration(context, textbox,
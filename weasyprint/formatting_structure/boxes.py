@@ -112,6 +112,11 @@ class Box(object):
         new_box.style = self.style.copy()
         return new_box
 
+    def deepcopy(self):
+        """Return a copy of the box and of all its descendants."""
+        # Overridden in ParentBox to also copy children, if any.
+        return self.copy()
+
     def translate(self, dx=0, dy=0):
         """Change the box’s position.
 
@@ -242,6 +247,12 @@ class ParentBox(Box):
         new_box._remove_decoration(not is_start, not is_end)
         return new_box
 
+    def deepcopy(self):
+        """Return a copy of the box and of all its descendants."""
+        new_box = super(ParentBox, self).deepcopy()
+        new_box.children = tuple(child.deepcopy() for child in self.children)
+        return new_box
+
     def descendants(self):
         """A flat generator for a box, its children and descendants."""
         yield self
@@ -303,6 +314,14 @@ class BlockBox(BlockContainerBox, BlockLevelBox):
 
     """
     # TODO: remove this when outside list marker are absolute children
+    def deepcopy(self):
+        """Return a copy of the box and of all its descendants."""
+        new_box = super(BlockBox, self).deepcopy()
+        marker = getattr(self, 'outside_list_marker', None)
+        if marker:
+            new_box.outside_list_marker = marker.deepcopy()
+        return new_box
+
     def translate(self, dx=0, dy=0):
         """Change the position of the box.
 
@@ -372,6 +391,10 @@ class TextBox(InlineLevelBox):
     inline boxes" are also text boxes.
 
     """
+    # Default value, may be overriden on instances. Index of the line of
+    # ``pango_layout`` that holds this box's text once laid out.
+    pango_line_index = 0
+
     def __init__(self, element_tag, sourceline, style, text):
         assert style.anonymous
         assert text
@@ -450,6 +473,13 @@ class TableBox(BlockLevelBox, ParentBox):
     # http://www.w3.org/TR/CSS21/tables.html#anonymous-boxes
     tabular_container = True
 
+    def deepcopy(self):
+        """Return a copy of the box and of all its descendants."""
+        new_box = super(TableBox, self).deepcopy()
+        new_box.column_groups = tuple(
+            group.deepcopy() for group in self.column_groups)
+        return new_box
+
     def translate(self, dx=0, dy=0):
         """Change the position of the box.
 
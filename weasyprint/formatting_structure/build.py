@@ -63,13 +63,17 @@ def build_formatting_structure(element_tree, style_for, get_image_from_uri):
 
 
 def make_box(element_tag, sourceline, style, content):
+    # Change copies of ``style``: the styles of children may be computed
+    # later from the computed style of the element, see css.StyleFor.
     if (style.display in ('table', 'inline-table')
             and style.border_collapse == 'collapse'):
         # Padding do not apply
+        style = style.copy()
         for side in ['top', 'bottom', 'left', 'right']:
             style['padding_' + side] = ZERO_PIXELS
     if style.display.startswith('table-') and style.display != 'table-caption':
         # Margins do not apply
+        style = style.copy()
         for side in ['top', 'bottom', 'left', 'right']:
             style['margin_' + side] = ZERO_PIXELS
 
@@ -18,6 +18,7 @@
 from __future__ import division, unicode_literals
 import os.path
 import logging
+import threading
 
 from .formatting_structure import boxes
 from .urls import get_url_attribute
@@ -26,14 +27,59 @@ from .logger import LOGGER
 from . import CSS
 
 
-# XXX temporarily disable logging for user-agent stylesheet
-level = LOGGER.level
-LOGGER.setLevel(logging.ERROR)
+UA_STYLESHEET_FILENAME = os.path.join(
+    os.path.dirname(__file__), 'css', 'html5_ua.css')
 
-HTML5_UA_STYLESHEET = CSS(
-    filename=os.path.join(os.path.dirname(__file__), 'css', 'html5_ua.css'))
+#: Where the preprocessed user-agent stylesheet is saved between processes,
+#: or ``None`` to parse it again in every process.
+UA_CACHE_DIRECTORY = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'weasyprint')
 
-LOGGER.setLevel(level)
+_ua_stylesheet = None
+_ua_stylesheet_lock = threading.Lock()
+
+
+def get_ua_stylesheet():
+    """Return the user-agent stylesheet as a :class:`CSS` object.
+
+    It is parsed on first use, or loaded from :obj:`UA_CACHE_DIRECTORY`.
+
+    """
+    global _ua_stylesheet
+    if _ua_stylesheet is None:
+        # Documents created in parallel threads wait for the first one
+        # to load the stylesheet, and the logging level is only changed
+        # and restored once.
+        with _ua_stylesheet_lock:
+            if _ua_stylesheet is None:
+                # XXX temporarily disable logging for user-agent stylesheet
+                level = LOGGER.level
+                LOGGER.setLevel(logging.ERROR)
+                try:
+                    _ua_stylesheet = CSS(
+                        filename=UA_STYLESHEET_FILENAME,
+                        _cache_directory=UA_CACHE_DIRECTORY)
+                finally:
+                    LOGGER.setLevel(level)
+    return _ua_stylesheet
+
+
+class LazyUAStylesheet(CSS):
+    """Stand-in for the user-agent stylesheet, loaded by
+    :func:`get_ua_stylesheet` when one of its attributes is first used.
+
+    """
+    def __init__(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(get_ua_stylesheet(), name)
+
+
+#: The user-agent stylesheet, kept for compatibility.
+#: Use :func:`get_ua_stylesheet` instead.
+HTML5_UA_STYLESHEET = LazyUAStylesheet()
 
 
 # Maps HTML tag names to function taking an HTML element and returning a Box.
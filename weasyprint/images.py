@@ -13,12 +13,19 @@
 from __future__ import division, unicode_literals
 
 from io import BytesIO
+import time
+import struct
+import hashlib
+import threading
 import contextlib
 
 import cairo
 
 from .css.computed_values import LENGTHS_TO_PIXELS
 from .logger import LOGGER
+from .stats import count
+from .urls import FetchBudgetError
+from .compat import HTTPException
 
 
 # Map MIME types to functions that take a byte stream and return a callable
@@ -26,6 +33,20 @@ from .logger import LOGGER
 # its dimension in pixels.
 FORMAT_HANDLERS = {}
 
+#: Process-wide cache for decoded images, shared by all documents.
+#: Disabled (``None``) by default, set it to a
+#: :class:`~weasyprint.cache.LRUCache` to enable it. Images are keyed by URI
+#: and content. Sizes are those of the decoded pixels, in bytes.
+IMAGE_CACHE = None
+
+#: Process-wide cache of image URIs that could not be fetched, shared by all
+#: documents. Disabled (``None``) by default, set it to a
+#: :class:`~weasyprint.cache.LRUCache` to enable it. Only network and HTTP
+#: errors of the default URL fetcher are cached, failed URIs are not
+#: fetched again for :obj:`FAILED_IMAGES_TTL` seconds.
+FAILED_IMAGES_CACHE = None
+FAILED_IMAGES_TTL = 60
+
 # TODO: currently CairoSVG only support images with an explicit
 # width and height. When it supports images with only an intrinsic ratio
 # this API will need to change.
@@ -90,6 +111,124 @@ def cairosvg_handler(file_obj, string, uri):
     return draw_svg
 
 
+# Surfaces with the same unique id are only embedded once by cairo 1.12+
+MIME_TYPE_UNIQUE_ID = getattr(cairo, 'MIME_TYPE_UNIQUE_ID', None)
+
+
+class JPEGPattern(object):
+    """Stand-in for the cairo pattern of a JPEG image.
+
+    The image is only decoded when drawn on a raster surface. Other surfaces
+    (eg. PDF) get the original JPEG bytes as MIME data and embed them
+    without re-compression. Use :func:`get_cairo_pattern` before drawing.
+
+    """
+    def __init__(self, string, uri, width, height):
+        self.string = string
+        self.uri = uri
+        self.width = width
+        self.height = height
+        if MIME_TYPE_UNIQUE_ID is None:
+            self.unique_id = None
+        else:
+            self.unique_id = hashlib.sha1(string).hexdigest().encode('ascii')
+        self._raster_surface = None
+        self._lock = threading.Lock()
+
+    def get_surface(self, raster):
+        """Return a cairo surface for the image.
+
+        Decoded surfaces for raster targets are shared by all callers.
+        Other surfaces only carry the JPEG bytes but have the memory of
+        blank pixels: they are created for each use and not kept.
+
+        """
+        if not raster:
+            surface = cairo.ImageSurface(
+                cairo.FORMAT_RGB24, self.width, self.height)
+            surface.set_mime_data(cairo.MIME_TYPE_JPEG, self.string)
+            if self.unique_id is not None:
+                # Embed the image once per PDF file, not once per use
+                surface.set_mime_data(MIME_TYPE_UNIQUE_ID, self.unique_id)
+            return surface
+        surface = self._raster_surface
+        if surface is None:
+            pattern, _, _ = fallback_handler(None, self.string, self.uri)()
+            # Pages may be drawn in parallel threads
+            with self._lock:
+                if self._raster_surface is None:
+                    self._raster_surface = pattern.get_surface()
+                surface = self._raster_surface
+        return surface
+
+
+def get_cairo_pattern(pattern, context, extend, filter_):
+    """Return a new cairo pattern to draw an image pattern on ``context``.
+
+    Image patterns are shared by the pages of a document and by documents,
+    which may be drawn in parallel threads: they are never changed. The
+    returned pattern uses the same surface with its own extend and filter.
+
+    """
+    if isinstance(pattern, JPEGPattern):
+        raster = isinstance(context.get_target(), cairo.ImageSurface)
+        surface = pattern.get_surface(raster)
+    else:
+        surface = pattern.get_surface()
+    pattern = cairo.SurfacePattern(surface)
+    pattern.set_extend(extend)
+    pattern.set_filter(filter_)
+    return pattern
+
+
+# Start Of Frame markers, but not DHT (C4), JPG (C8) and DAC (CC)
+JPEG_SOF_MARKERS = frozenset([0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                              0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+
+
+def get_jpeg_size(string):
+    """Return the ``(width, height)`` of a JPEG image from its header."""
+    if not string.startswith(b'\xff\xd8'):
+        raise ValueError('Not a JPEG image')
+    position = 2
+    while position + 4 <= len(string):
+        marker_start, marker = struct.unpack(
+            '>BB', string[position:position + 2])
+        if marker_start != 0xFF:
+            raise ValueError('Invalid JPEG marker at byte %i' % position)
+        if marker == 0xFF:
+            # Fill byte
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            # Markers without a segment
+            position += 2
+            continue
+        length, = struct.unpack('>H', string[position + 2:position + 4])
+        if marker in JPEG_SOF_MARKERS:
+            # Segment: length, sample precision, height, width
+            height, width = struct.unpack(
+                '>HH', string[position + 5:position + 9])
+            return width, height
+        position += 2 + length
+    raise ValueError('No JPEG frame header')
+
+
+@register_format('image/jpeg')
+def jpeg_handler(file_obj, string, uri):
+    """Return a :class:`JPEGPattern` for a JPEG byte stream."""
+    if file_obj:
+        string = file_obj.read()
+    if not hasattr(cairo.ImageSurface, 'set_mime_data'):
+        # Older pycairo
+        return fallback_handler(None, string, uri)
+    width, height = get_jpeg_size(string)
+    if not (width > 0 and height > 0):
+        raise ValueError('Invalid JPEG size: %ix%i' % (width, height))
+    result = JPEGPattern(string, uri, width, height), width, height
+    return lambda: result
+
+
 def fallback_handler(file_obj, string, uri):
     """
     Parse a byte stream with PIL and return a cairo Surface.
@@ -111,30 +250,102 @@ def fallback_handler(file_obj, string, uri):
     return png_handler(None, png_bytes, uri)
 
 
-def get_image_from_uri(cache, url_fetcher, uri, type_=None):
-    """Get a :class:`cairo.Surface`` from an image URI."""
+def get_shared_image(shared_cache, handler, file_obj, string, uri, type_):
+    """Return the image function for this content from ``shared_cache``,
+    or decode the image and add it to the cache.
+
+    Decoded surfaces are cached, not patterns: documents do not share
+    pattern objects.
+
+    """
+    if file_obj:
+        string = file_obj.read()
+    key = uri, type_, hashlib.sha1(string).hexdigest()
+    function = shared_cache.get(key)
+    if function is not None:
+        count('image_cache_hits')
+        return function
+    function = handler(None, string, uri)
+    if handler is cairosvg_handler:
+        # Only the source is kept, surfaces are created for each use.
+        size = len(string)
+    else:
+        pattern, width, height = function()
+        size = 4 * width * height
+        if isinstance(pattern, cairo.SurfacePattern):
+            # Share the surface, each caller gets its own pattern.
+            function = surface_pattern_function(
+                pattern.get_surface(), width, height)
+    shared_cache.set(key, function, size)
+    return function
+
+
+def surface_pattern_function(surface, width, height):
+    """Return an image function giving a new pattern for ``surface``."""
+    return lambda: (cairo.SurfacePattern(surface), width, height)
+
+
+def get_image_from_uri(cache, url_fetcher, uri, type_=None,
+                       cache_failures=False):
+    """Get a :class:`cairo.Surface`` from an image URI.
+
+    Return ``None`` and log a warning if the image can not be loaded.
+    Failures are also cached: the warning is only logged once per document.
+
+    If ``cache_failures`` is true (``url_fetcher`` is the default fetcher),
+    network and HTTP errors are also kept in :obj:`FAILED_IMAGES_CACHE`.
+
+    """
+    missing = object()
+    function = cache.get(uri, missing)
+    if function is None:
+        return None
+    failed_cache = FAILED_IMAGES_CACHE if cache_failures else None
     try:
-        missing = object()
-        function = cache.get(uri, missing)
         if function is not missing:
             return function()
-        result = url_fetcher(uri)
+        if failed_cache is not None:
+            failed_until = failed_cache.get(uri)
+            if failed_until is not None and failed_until > time.time():
+                count('failed_image_hits')
+                LOGGER.debug('Image at %s failed less than %is ago, '
+                             'not fetched again', uri, FAILED_IMAGES_TTL)
+                cache[uri] = None
+                return None
+        count('image_fetches')
+        try:
+            result = url_fetcher(uri)
+        except (IOError, HTTPException) as exc:
+            # Errors of this document (eg. its fetch time budget) do not
+            # prevent other documents from fetching the image.
+            if (failed_cache is not None and not uri.startswith('data:')
+                    and not isinstance(exc, FetchBudgetError)):
+                failed_cache.set(uri, time.time() + FAILED_IMAGES_TTL)
+            raise
+        file_obj = result.get('file_obj')
         try:
             if not type_:
                 type_ = result['mime_type']  # Use eg. the HTTP header
             #else: the type was forced by eg. a 'type' attribute on <embed>
             handler = FORMAT_HANDLERS.get(type_, fallback_handler)
-            function = handler(
-                result.get('file_obj'), result.get('string'), uri)
+            shared_cache = IMAGE_CACHE
+            if shared_cache is None:
+                function = handler(file_obj, result.get('string'), uri)
+            else:
+                function = get_shared_image(
+                    shared_cache, handler, file_obj, result.get('string'),
+                    uri, type_)
         finally:
-            try:
-                file_like.close()
-            except Exception:  # pragma: no cover
-                # May already be closed or something.
-                # This is just cleanup anyway.
-                pass
+            if file_obj:
+                try:
+                    file_obj.close()
+                except Exception:  # pragma: no cover
+                    # May already be closed or something.
+                    # This is just cleanup anyway.
+                    pass
 
         cache[uri] = function
         return function()
     except Exception as exc:
         LOGGER.warn('Error for image at %s : %r', uri, exc)
+        cache[uri] = None
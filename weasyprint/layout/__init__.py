@@ -21,20 +21,25 @@
 
 from __future__ import division, unicode_literals
 
-from .absolute import absolute_layout
+from .absolute import absolute_layout, AbsolutePlaceholder
 from .pages import make_all_pages, make_margin_boxes
+from ..stats import count
 
 
-def layout_fixed_boxes(context, pages):
-    """Lay out and yield the fixed boxes of ``pages``."""
-    for page in pages:
-        for fixed_box in page.fixed_boxes:
-            fixed_box_for_page = fixed_box.copy()
-            # Use an empty list as last argument because the fixed boxes in the
-            # fixed box has already been added to page.fixed_boxes, we don't
-            # want to get them again
-            absolute_layout(context, fixed_box_for_page, page, [])
-            yield fixed_box_for_page
+def layout_fixed_boxes(context, fixed_boxes, page):
+    """Lay out and yield ``fixed_boxes`` with ``page`` as containing block."""
+    for fixed_box in fixed_boxes:
+        # Copy the descendants too: laying out absolute descendants changes
+        # their boxes, and each page geometry needs its own.
+        placeholder = AbsolutePlaceholder(fixed_box.deepcopy())
+        # Fixed boxes inside fixed boxes are not in page.fixed_boxes,
+        # they are repeated with their parent.
+        nested_boxes = []
+        absolute_layout(context, placeholder, page, nested_boxes)
+        for nested_box in nested_boxes:
+            absolute_layout(context, nested_box, page, nested_boxes)
+        count('fixed_box_layouts')
+        yield placeholder
 
 
 def layout_document(context, root_box):
@@ -48,15 +53,33 @@ def layout_document(context, root_box):
 
     """
     pages = list(make_all_pages(context, root_box))
+    # (page index, box) for the fixed boxes of all pages, in document order
+    fixed_boxes = [(i, fixed_box) for i, page in enumerate(pages)
+                   for fixed_box in page.fixed_boxes]
+    # Fixed boxes are laid out once for each page geometry, and each page
+    # gets its own copy of the result: replaced boxes can only be drawn once.
+    laid_out_fixed_boxes = {}
     page_counter = [1]
     counter_values = {'page': page_counter, 'pages': [len(pages)]}
     for i, page in enumerate(pages):
-        root_children = []
         root, = page.children
-        root_children.extend(layout_fixed_boxes(context, pages[:i]))
-        root_children.extend(root.children)
-        root_children.extend(layout_fixed_boxes(context, pages[i+1:]))
-        root = root.copy_with_children(root_children)
+        before = []
+        after = []
+        if fixed_boxes:
+            geometry = (page.content_box_x(), page.content_box_y(),
+                        page.width, page.height)
+            if geometry not in laid_out_fixed_boxes:
+                laid_out_fixed_boxes[geometry] = list(layout_fixed_boxes(
+                    context, [fixed_box for _, fixed_box in fixed_boxes],
+                    page))
+            for (index, _), placeholder in zip(
+                    fixed_boxes, laid_out_fixed_boxes[geometry]):
+                # Fixed boxes of this page are already in its children
+                if index < i:
+                    before.append(placeholder.deepcopy())
+                elif index > i:
+                    after.append(placeholder.deepcopy())
+        root = root.copy_with_children(before + list(root.children) + after)
         page.children = (root,) + tuple(
             make_margin_boxes(context, page, counter_values))
         yield page
@@ -68,9 +91,33 @@ class LayoutContext(object):
         self.enable_hinting = enable_hinting
         self.style_for = style_for
         self.get_image_from_uri = get_image_from_uri
+        # (TextBox, skip, available width) -> (ParagraphLayout, line index),
+        # see inlines.split_text_box. Only kept for the current and previous
+        # pages, see start_page.
+        self.line_breaks = {}
+        self._previous_line_breaks = {}
+        # (box, ...) -> width, see layout.preferred
+        self.preferred_widths = {}
         self._excluded_shapes_lists = []
         self.excluded_shapes = None  # Not initialized yet
 
+    def get_line_break(self, key):
+        """Return a line break kept for the current or previous page."""
+        line_break = self.line_breaks.get(key)
+        if line_break is None:
+            line_break = self._previous_line_breaks.get(key)
+        return line_break
+
+    def start_page(self):
+        """Forget the line breaks of pages before the previous one.
+
+        Lines are reused when a page break is moved earlier on the current
+        page, or for the rest of a paragraph on the next page.
+
+        """
+        self._previous_line_breaks = self.line_breaks
+        self.line_breaks = {}
+
     def create_block_formatting_context(self):
         self.excluded_shapes = []
         self._excluded_shapes_lists.append(self.excluded_shapes)
@@ -43,6 +43,11 @@ class AbsolutePlaceholder(object):
         object.__setattr__(new_placeholder, '_layout_done', self._layout_done)
         return new_placeholder
 
+    def deepcopy(self):
+        new_placeholder = AbsolutePlaceholder(self._box.deepcopy())
+        object.__setattr__(new_placeholder, '_layout_done', self._layout_done)
+        return new_placeholder
+
     # Pretend to be the box itself
     def __getattr__(self, name):
         return getattr(self._box, name)
@@ -19,7 +19,8 @@ from .min_max import handle_min_max_width, handle_min_max_height
 from .percentages import resolve_percentages, resolve_one_percentage
 from .preferred import shrink_to_fit, inline_preferred_minimum_width
 from .tables import find_in_flow_baseline, table_wrapper_width
-from ..text import split_first_line
+from ..text import ParagraphLayout
+from ..stats import count
 from ..formatting_structure import boxes
 from ..css.computed_values import strut_layout
 
@@ -224,7 +225,8 @@ def remove_last_whitespace(context, box):
     if new_text:
         if len(new_text) == len(box.text):
             return
-        new_box, resume, _ = split_text_box(context, box, box.width * 2, 0)
+        new_box, resume, _ = split_text_box(
+            context, box, box.width * 2, 0, reuse_lines=False)
         assert new_box is not None
         assert resume is None
         space_width = box.width - new_box.width
@@ -654,44 +656,54 @@ def split_inline_box(context, box, position_x, max_x, skip_stack,
     return new_box, resume_at, preserved_line_break
 
 
-def split_text_box(context, box, available_width, skip):
+def split_text_box(context, box, available_width, skip, reuse_lines=True):
     """Keep as much text as possible from a TextBox in a limitied width.
     Try not to overflow but always have some text in ``new_box``
 
-    Return ``(new_box, skip)``. ``skip`` is the number of UTF-8 bytes
+    Return ``(new_box, skip)``. ``skip`` is the number of Unicode code points
     to skip form the start of the TextBox for the next line, or ``None``
     if all of the text fits.
 
     Also break an preserved whitespace.
 
+    If ``reuse_lines`` is false, the lines are not looked up or kept in
+    ``context.line_breaks``: use this to lay out a line box again.
+
     """
     assert isinstance(box, boxes.TextBox)
     font_size = box.style.font_size
-    text = box.text[skip:]
-    if font_size == 0 or not text:
+    if font_size == 0 or skip >= len(box.text):
         return None, None, False
-    # XXX ``resume_at`` is an index in UTF-8 bytes, not unicode codepoints.
-    layout, length, resume_at, width, height, baseline = split_first_line(
-        text, box.style, context.enable_hinting, available_width)
-
-    # Convert ``length`` and ``resume_at`` from UTF-8 indexes in text
-    # to Unicode indexes.
-    # No need to encode what’s after resume_at (if set) or length (if
-    # resume_at is not set). One code point is one or more byte, so
-    # UTF-8 indexes are always bigger or equal to Unicode indexes.
-    partial_text = text[:resume_at or length]
-    utf8_text = partial_text.encode('utf8')
-    new_text = utf8_text[:length].decode('utf8')
-    new_length = len(new_text)
+    # Lines of a text box are usually split one after the other with the
+    # same available width, and the same lines are split again when a page
+    # break is moved earlier: every line of a paragraph layout is kept, and
+    # the remaining text is only shaped again for a new width or offset.
+    key = (box, skip, available_width)
+    line_break = context.get_line_break(key) if reuse_lines else None
+    if line_break is None or line_break[0].text is not box.text:
+        paragraph = ParagraphLayout(
+            box.text, box.style, context.enable_hinting, available_width,
+            offset=skip)
+        if reuse_lines:
+            for start, index in paragraph.iter_line_starts():
+                context.line_breaks[box, start, available_width] = (
+                    paragraph, index)
+        line_break = paragraph, 0
+    else:
+        count('reused_line_breaks')
+    paragraph, line_index = line_break
+    _, _, length, resume_at, width, height, baseline = paragraph.get_line(
+        line_index)
+    # ``length`` and ``resume_at`` are in Unicode code points from ``skip``.
+    new_text = box.text[skip:skip + length]
     if resume_at is not None:
-        between = utf8_text[length:resume_at].decode('utf8')
-        resume_at = new_length + len(between)
-    length = new_length
+        between = box.text[skip + length:skip + resume_at]
 
     if length > 0:
         box = box.copy_with_text(new_text)
         box.width = width
-        box.pango_layout = layout
+        box.pango_layout = paragraph.layout
+        box.pango_line_index = line_index
         # "The height of the content area should be based on the font,
         #  but this specification does not specify how."
         # http://www.w3.org/TR/CSS21/visudet.html#inline-non-replaced
@@ -936,7 +948,7 @@ def add_word_spacing(context, box, extra_word_spacing, x_advance):
         nb_spaces = count_spaces(box)
         if nb_spaces > 0:
             new_box, resume_at, _ = split_text_box(
-                context, box, 1e10, 0)
+                context, box, 1e10, 0, reuse_lines=False)
             assert new_box is not None
             assert resume_at is None
             # XXX new_box.width - box.width is always 0???
@@ -944,6 +956,7 @@ def add_word_spacing(context, box, extra_word_spacing, x_advance):
             x_advance += extra_word_spacing * nb_spaces
             box.width = new_box.width
             box.pango_layout = new_box.pango_layout
+            box.pango_line_index = new_box.pango_line_index
     elif isinstance(box, (boxes.LineBox, boxes.InlineBox)):
         box.position_x += x_advance
         previous_x_advance = x_advance
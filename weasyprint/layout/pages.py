@@ -505,6 +505,11 @@ def make_page(context, root_box, page_type, resume_at, content_empty):
         positioned_boxes, positioned_boxes, adjoining_margins)
     assert root_box
 
+    # Fixed boxes are repeated on every page, see layout_document.
+    # Keep copies made before their layout on this page.
+    page.fixed_boxes = [
+        placeholder._box.copy() for placeholder in positioned_boxes
+        if placeholder.style.position == 'fixed']
     for absolute_box in positioned_boxes:
         absolute_layout(context, absolute_box, page, positioned_boxes)
     context.finish_block_formatting_context(root_box)
@@ -534,6 +539,7 @@ def make_all_pages(context, root_box):
         page_type = prefix + ('right_page' if right_page else 'left_page')
         content_empty = ((next_page == 'left' and right_page) or
                          (next_page == 'right' and not right_page))
+        context.start_page()
         page, resume_at, next_page = make_page(
             context, root_box, page_type, resume_at, content_empty)
         assert next_page
@@ -5,6 +5,10 @@
 
     Preferred and minimum preferred width, aka. the shrink-to-fit algorithm.
 
+    Widths are cached for each box in ``context.preferred_widths``: they only
+    depend on the style and children of boxes, which layout does not change
+    in place. Split or copied boxes are new objects and are measured again.
+
     :copyright: Copyright 2011-2012 Simon Sapin and contributors, see AUTHORS.
     :license: BSD, see LICENSE for details.
 
@@ -15,6 +19,7 @@ from __future__ import division, unicode_literals
 import cairo
 
 from ..formatting_structure import boxes
+from ..stats import count
 from .. import text
 
 
@@ -40,6 +45,17 @@ def preferred_minimum_width(context, box, outer=True):
     This is the width by breaking at every line-break opportunity.
 
     """
+    key = box, outer, 'minimum'
+    width = context.preferred_widths.get(key)
+    if width is None:
+        width = _preferred_minimum_width(context, box, outer)
+        context.preferred_widths[key] = width
+    else:
+        count('preferred_width_hits')
+    return width
+
+
+def _preferred_minimum_width(context, box, outer):
     if isinstance(box, boxes.BlockContainerBox):
         if box.is_table_wrapper:
             return table_preferred_minimum_width(context, box, outer)
@@ -61,6 +77,17 @@ def preferred_width(context, box, outer=True):
     This is the width by only breaking at forced line breaks.
 
     """
+    key = box, outer, 'preferred'
+    width = context.preferred_widths.get(key)
+    if width is None:
+        width = _preferred_width(context, box, outer)
+        context.preferred_widths[key] = width
+    else:
+        count('preferred_width_hits')
+    return width
+
+
+def _preferred_width(context, box, outer):
     if isinstance(box, boxes.BlockContainerBox):
         if box.is_table_wrapper:
             return table_preferred_width(context, box, outer)
@@ -165,11 +192,12 @@ def inline_preferred_minimum_width(context, box, outer=True, skip_stack=None,
             current_line = inline_preferred_minimum_width(
                 context, child, skip_stack=skip_stack, first_line=first_line)
         elif isinstance(child, boxes.TextBox):
-            widths = text.line_widths(child, context.enable_hinting, width=0)
             if first_line:
-                return next(widths)
+                return next(text.line_widths(
+                    child, context.enable_hinting, width=0))
             else:
-                current_line = max(widths)
+                current_line = text.min_content_width(
+                    child, context.enable_hinting)
         else:
             current_line = preferred_minimum_width(context, child)
         widest_line = max(widest_line, current_line)
@@ -219,6 +247,46 @@ def table_and_columns_preferred_widths(context, box, outer=True,
 
     """
     table = box.get_wrapped_table()
+    key = box, 'columns'
+    widths = context.preferred_widths.get(key)
+    if widths is None:
+        widths = _columns_preferred_widths(context, box, table)
+        context.preferred_widths[key] = widths
+    (table_preferred_minimum_width, table_preferred_width,
+     column_preferred_minimum_widths, column_preferred_widths,
+     caption_width) = widths
+
+    if table.style.width != 'auto':
+        # Take care of the table width
+        if resolved_table_width:
+            if table.width > table_preferred_minimum_width:
+                table_preferred_minimum_width = table.width
+        else:
+            if (table.style.width.unit != '%' and
+                table.style.width.value > table_preferred_minimum_width):
+                table_preferred_minimum_width = table.style.width.value
+
+    if table_preferred_minimum_width < caption_width:
+        table_preferred_minimum_width = caption_width
+
+    if table_preferred_minimum_width > table_preferred_width:
+        table_preferred_width = table_preferred_minimum_width
+
+    # Copies: callers may change the lists
+    return (
+        table_preferred_minimum_width, table_preferred_width,
+        list(column_preferred_minimum_widths), list(column_preferred_widths))
+
+
+def _columns_preferred_widths(context, box, table):
+    """Return the preferred widths of a table, ignoring its own width.
+
+    The tuple returned is
+    ``(table_preferred_minimum_width, table_preferred_width,
+    column_preferred_minimum_widths, column_preferred_widths,
+    caption_width)``
+
+    """
     if table.style.border_collapse == 'separate':
         border_spacing_x, _ = table.style.border_spacing
     else:
@@ -356,25 +424,10 @@ def table_and_columns_preferred_widths(context, box, outer=True,
     else:
         caption_width = 0
 
-    if table.style.width != 'auto':
-        # Take care of the table width
-        if resolved_table_width:
-            if table.width > table_preferred_minimum_width:
-                table_preferred_minimum_width = table.width
-        else:
-            if (table.style.width.unit != '%' and
-                table.style.width.value > table_preferred_minimum_width):
-                table_preferred_minimum_width = table.style.width.value
-
-    if table_preferred_minimum_width < caption_width:
-        table_preferred_minimum_width = caption_width
-
-    if table_preferred_minimum_width > table_preferred_width:
-        table_preferred_width = table_preferred_minimum_width
-
     return (
         table_preferred_minimum_width, table_preferred_width,
-        column_preferred_minimum_widths, column_preferred_widths)
+        column_preferred_minimum_widths, column_preferred_widths,
+        caption_width)
 
 
 def table_preferred_minimum_width(context, box, outer=True):
@@ -133,7 +133,10 @@ class PDFDictionary(object):
 class PDFFile(object):
     """
     :param fileobj:
-        A seekable binary file-like object for a PDF generated by cairo.
+        A seekable binary file-like object for a PDF generated by cairo,
+        open for both reading and writing. The PDF must start at the
+        beginning of the file. Changes are appended to the file
+        as an incremental update.
 
     """
     trailer_re = re.compile(
@@ -147,21 +150,23 @@ class PDFFile(object):
         trailer = PDFDictionary(None, trailer)
         startxref = int(startxref)
 
+        # Only use .readline(): some file-like objects (eg. spooled
+        # temporary files) are not iterators.
         fileobj.seek(startxref)
-        line = next(fileobj)
+        line = fileobj.readline()
         assert line == b'xref\n'
 
-        line = next(fileobj)
+        line = fileobj.readline()
         first_object, total_objects = line.split()
         assert first_object == b'0'
         total_objects = int(total_objects)
 
-        line = next(fileobj)
+        line = fileobj.readline()
         assert line == b'0000000000 65535 f \n'
 
         objects_offsets = [None]
         for object_number in xrange(1, total_objects):
-            line = next(fileobj)
+            line = fileobj.readline()
             assert line[10:] == b' 00000 n \n'
             objects_offsets.append(int(line[:10]))
 
@@ -196,14 +201,14 @@ class PDFFile(object):
         """
         fileobj = self.fileobj
         fileobj.seek(self.objects_offsets[object_number])
-        line = next(fileobj)
+        line = fileobj.readline()
         assert line.endswith(b' 0 obj\n')
         assert int(line[:-7]) == object_number  # len(b' 0 obj\n') == 7
         object_lines = []
-        for line in fileobj:
+        for line in iter(fileobj.readline, b''):
             object_lines.append(line)
             if line == b'>>\n':
-                assert next(fileobj) == b'endobj\n'
+                assert fileobj.readline() == b'endobj\n'
                 return b''.join(object_lines)
 
     def overwrite_object(self, object_number, byte_string):
@@ -0,0 +1,129 @@
+# coding: utf8
+"""
+    weasyprint.png
+    --------------
+
+    Write a tall PNG image made of many pages, one band of rows at a time.
+
+    cairo can only encode a whole surface, so every band is encoded by cairo
+    then decompressed. PNG scanlines are filtered independently except for
+    references to the previous row, so the filtered scanlines of all bands
+    can be compressed again in a single image once the first row of each
+    band does not refer to the (empty) row before it.
+
+    :copyright: Copyright 2011-2012 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals
+
+import io
+import zlib
+import struct
+
+import cairo
+
+from .compat import xrange
+
+
+#: Maximum number of rows encoded at once.
+BAND_HEIGHT = 256
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG filter types
+FILTER_NONE = 0
+FILTER_SUB = 1
+FILTER_UP = 2
+FILTER_AVERAGE = 3
+FILTER_PAETH = 4
+
+
+def write_chunk(file_obj, chunk_type, data):
+    file_obj.write(struct.pack('>I', len(data)))
+    file_obj.write(chunk_type)
+    file_obj.write(data)
+    crc = zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff
+    file_obj.write(struct.pack('>I', crc))
+
+
+def read_chunks(png_bytes):
+    """Yield ``(chunk_type, data)`` tuples from a PNG byte string."""
+    assert png_bytes.startswith(PNG_SIGNATURE)
+    position = len(PNG_SIGNATURE)
+    while position < len(png_bytes):
+        length, = struct.unpack('>I', png_bytes[position:position + 4])
+        chunk_type = png_bytes[position + 4:position + 8]
+        yield chunk_type, png_bytes[position + 8:position + 8 + length]
+        position += 12 + length  # length, type, data, CRC
+
+
+def get_scanlines(surface, height):
+    """Return the filtered PNG scanlines for the first ``height`` rows
+    of ``surface``, with the first row independent of any previous row.
+
+    The surface must have at least one more row, transparent, so that cairo
+    writes RGBA pixels even if the other rows are opaque.
+
+    """
+    file_obj = io.BytesIO()
+    surface.write_to_png(file_obj)
+    idat = []
+    for chunk_type, data in read_chunks(file_obj.getvalue()):
+        if chunk_type == b'IHDR':
+            # Bit depth 8, color type 6 (RGBA), not interlaced
+            assert data[8:] == b'\x08\x06\x00\x00\x00', data
+        elif chunk_type == b'IDAT':
+            idat.append(data)
+    row_size = 1 + 4 * surface.get_width()
+    scanlines = zlib.decompress(b''.join(idat))
+    first_row = bytearray(scanlines[:row_size])
+    # Filters of the first row have a previous row of zeros.
+    if first_row[0] == FILTER_UP:
+        first_row[0] = FILTER_NONE
+    elif first_row[0] == FILTER_PAETH:
+        # The Paeth predictor is the left pixel when the upper row is empty
+        first_row[0] = FILTER_SUB
+    elif first_row[0] == FILTER_AVERAGE:
+        for i in xrange(5, row_size):
+            first_row[i] = (first_row[i] + (first_row[i - 4] >> 1)) & 0xff
+        first_row[0] = FILTER_NONE
+    return bytes(first_row) + scanlines[row_size:height * row_size]
+
+
+def write_png(file_obj, surfaces, width, height):
+    """Write a single PNG image with ``surfaces`` from top to bottom,
+    each centered horizontally.
+
+    :param file_obj: A file-like object with a ``write`` method.
+    :param surfaces: An iterable of ``(width, height, surface)`` tuples.
+    :param width: The width of the image, at least that of every surface.
+    :param height: The height of the image, the sum of all heights.
+
+    Only one surface of ``surfaces`` is used at a time, and the memory
+    used does not depend on ``height``.
+
+    """
+    file_obj.write(PNG_SIGNATURE)
+    # Bit depth 8, color type 6 (RGBA), default compression and filters,
+    # not interlaced
+    write_chunk(file_obj, b'IHDR', struct.pack(
+        '>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+    compressor = zlib.compressobj()
+    for surface_width, surface_height, surface in surfaces:
+        pos_x = (width - surface_width) // 2
+        for band_top in xrange(0, surface_height, BAND_HEIGHT):
+            band_height = min(BAND_HEIGHT, surface_height - band_top)
+            band = cairo.ImageSurface(
+                cairo.FORMAT_ARGB32, width, band_height + 1)
+            context = cairo.Context(band)
+            context.rectangle(0, 0, width, band_height)
+            context.clip()
+            context.set_source_surface(surface, pos_x, -band_top)
+            context.paint()
+            data = compressor.compress(get_scanlines(band, band_height))
+            if data:
+                write_chunk(file_obj, b'IDAT', data)
+    write_chunk(file_obj, b'IDAT', compressor.flush())
+    write_chunk(file_obj, b'IEND', b'')
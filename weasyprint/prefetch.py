@@ -0,0 +1,167 @@
+# coding: utf8
+"""
+    weasyprint.prefetch
+    -------------------
+
+    Fetch the stylesheets and images of a document concurrently.
+
+    Without prefetching, each resource is fetched when it is first needed,
+    one at a time. :meth:`Document.prefetch` finds URLs in the HTML tree,
+    then in the cascaded styles, and fetches them in a pool of threads.
+    :class:`PrefetchingURLFetcher` keeps the results until they are used.
+
+    :copyright: Copyright 2011-2012 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals
+
+import functools
+from multiprocessing.pool import ThreadPool
+
+from .css import find_stylesheet_elements
+from .urls import url_is_absolute
+from .compat import urljoin, basestring, iteritems
+from .stats import count
+
+
+#: Default maximum number of resources fetched at the same time.
+DEFAULT_WORKERS = 8
+
+# Elements handled in html.py, and the attribute of their image URL
+IMAGE_ATTRIBUTES = {'img': 'src', 'embed': 'src', 'object': 'data'}
+
+IMAGE_PROPERTIES = ('background_image', 'list_style_image')
+
+
+def element_url(element, attr_name):
+    """Like :func:`urls.get_url_attribute`, but without warnings:
+    they are logged when the URL is actually used.
+
+    """
+    value = element.get(attr_name, '').strip()
+    if value:
+        if url_is_absolute(value):
+            return value
+        elif element.base_url:
+            return urljoin(element.base_url, value)
+
+
+def find_tree_urls(element_tree, medium):
+    """Yield the URLs of stylesheets and images in the HTML tree."""
+    for element in find_stylesheet_elements(element_tree, medium):
+        if element.tag == 'link':
+            yield element_url(element, 'href')
+    for element in element_tree.iter():
+        attr_name = IMAGE_ATTRIBUTES.get(element.tag)
+        if attr_name:
+            yield element_url(element, attr_name)
+
+
+def is_hidden(declarations):
+    """Return whether cascaded ``declarations`` have ``display: none``."""
+    return 'display' in declarations and declarations['display'][0] == 'none'
+
+
+def find_style_urls(cascaded_styles):
+    """Yield the URLs of images in cascaded styles.
+
+    Elements with a cascaded ``display: none``, their pseudo-elements and
+    their descendants are skipped: their images are never used.
+
+    """
+    hidden = set(element for (element, pseudo_type), declarations
+                 in iteritems(cascaded_styles)
+                 if pseudo_type is None and is_hidden(declarations))
+    for (element, pseudo_type), declarations in iteritems(cascaded_styles):
+        if is_hidden(declarations) or (hidden and (element in hidden or (
+                # Page types for @page rules are strings
+                hasattr(element, 'iterancestors') and any(
+                    ancestor in hidden
+                    for ancestor in element.iterancestors())))):
+            continue
+        for name in IMAGE_PROPERTIES:
+            if name in declarations:
+                value, _precedence = declarations[name]
+                if value not in ('none', 'inherit', 'initial'):
+                    yield value
+        if 'content' in declarations:
+            values, _precedence = declarations['content']
+            if not isinstance(values, basestring):
+                for type_, value in values:
+                    if type_ == 'URI':
+                        yield value
+
+
+def fetch(url_fetcher, url):
+    """Return the result of ``url_fetcher`` with its content read,
+    or the exception it raised.
+
+    """
+    try:
+        result = url_fetcher(url)
+        if 'file_obj' in result:
+            result = dict(result)
+            file_obj = result.pop('file_obj')
+            try:
+                result['string'] = file_obj.read()
+            finally:
+                file_obj.close()
+        return result
+    except Exception as exc:
+        return exc
+
+
+class PrefetchingURLFetcher(object):
+    """Wrap an URL fetcher to give the results of :meth:`prefetch` first.
+
+    Each prefetched result is only used once, the same URL is fetched again
+    by ``url_fetcher`` afterwards.
+
+    """
+    def __init__(self, url_fetcher):
+        self.url_fetcher = url_fetcher
+        self._results = {}
+
+    def __call__(self, url):
+        # dict.pop is atomic: pages can be drawn in parallel threads.
+        result = self._results.pop(url, None)
+        if result is None:
+            return self.url_fetcher(url)
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            return result
+
+    def clear(self):
+        """Drop the prefetched results that were not used."""
+        self._results.clear()
+
+    def prefetch(self, urls, workers=None):
+        """Fetch ``urls`` in up to ``workers`` threads and keep the results.
+
+        ``data:`` URLs and URLs already prefetched are skipped.
+
+        """
+        if workers is None:
+            workers = DEFAULT_WORKERS
+        seen = set(self._results)
+        todo = []
+        for url in urls:
+            if url and url not in seen and not url.startswith('data:'):
+                seen.add(url)
+                todo.append(url)
+        if not todo:
+            return
+        function = functools.partial(fetch, self.url_fetcher)
+        if workers <= 1:
+            results = [function(url) for url in todo]
+        else:
+            pool = ThreadPool(min(workers, len(todo)))
+            try:
+                results = pool.map(function, todo)
+            finally:
+                pool.terminate()
+        count('prefetched_urls', len(todo))
+        self._results.update(zip(todo, results))
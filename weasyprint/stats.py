@@ -0,0 +1,86 @@
+# coding: utf8
+"""
+    weasyprint.stats
+    ----------------
+
+    Timings and counters for the rendering of a document.
+
+    Stages are timed by :class:`Document` with :meth:`Stats.stage`.
+    Code deeper in the rendering process does not know about documents
+    and calls :func:`count` instead, which adds to the statistics of
+    the stage currently running in the same thread, if any.
+
+    :copyright: Copyright 2011-2012 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals
+
+import threading
+import contextlib
+from timeit import default_timer
+
+from .compat import iteritems
+
+
+_current = threading.local()
+
+
+def count(name, number=1):
+    """Add ``number`` to the ``name`` counter of the current document."""
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        with stats.lock:
+            counters = stats.counters
+            counters[name] = counters.get(name, 0) + number
+
+
+class Stats(object):
+    """Statistics for a :class:`Document`.
+
+    ``timings`` is a dict of stage name -> ``[calls, seconds]``.
+    The time of a stage includes the time of the stages it triggers:
+    ``write_pdf`` includes ``pages`` if the document was not laid out yet.
+
+    ``counters`` is a dict of event name -> number of events, eg.
+    ``pango_layouts``, ``image_fetches`` or ``pages_laid_out``.
+
+    """
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        # Pages can be drawn in parallel, see Document.get_png_surfaces
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the ``with`` block and collect counters during it."""
+        previous = getattr(_current, 'stats', None)
+        _current.stats = self
+        start = default_timer()
+        try:
+            yield
+        finally:
+            elapsed = default_timer() - start
+            _current.stats = previous
+            with self.lock:
+                timing = self.timings.setdefault(name, [0, 0])
+                timing[0] += 1
+                timing[1] += elapsed
+
+    def as_dict(self):
+        """Return the statistics as JSON-compatible dicts and lists."""
+        return {
+            'timings': dict(
+                (name, {'calls': calls, 'seconds': seconds})
+                for name, (calls, seconds) in iteritems(self.timings)),
+            'counters': dict(self.counters)}
+
+    def __str__(self):
+        timings = ', '.join(
+            '%s: %.3fs (%i)' % (name, seconds, calls)
+            for name, (calls, seconds) in sorted(iteritems(self.timings)))
+        counters = ', '.join(
+            '%s: %i' % item for item in sorted(iteritems(self.counters)))
+        return 'timings: %s; counters: %s' % (timings, counters)
@@ -0,0 +1,14 @@
+# coding: utf8
+"""
+    weasyprint.tests.benchmarks
+    ---------------------------
+
+    Scripts measuring the speed and memory use of WeasyPrint.
+    They are not run by the test suite.
+
+    :copyright: Copyright 2011-2012 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals
@@ -0,0 +1,247 @@
+# coding: utf8
+"""
+    weasyprint.tests.benchmarks.documents
+    -------------------------------------
+
+    Generated documents that stress specific parts of WeasyPrint.
+
+    Each function takes a ``scale`` factor (1 for the full size) and
+    returns an ``(html, css)`` tuple of Unicode strings. Relative URLs
+    are resolved against the ``tests/resources`` directory.
+
+    :copyright: Copyright 2011-2012 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals
+
+from ...compat import xrange
+
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+
+def words(number, start=0):
+    """Return ``number`` words of dummy text."""
+    return ' '.join(WORDS[(start + i) % len(WORDS)] for i in xrange(number))
+
+
+def scaled(number, scale):
+    return max(1, int(number * scale))
+
+
+def long_text(scale):
+    """About 500 pages of justified paragraphs with headings."""
+    parts = []
+    for i in xrange(scaled(500, scale)):
+        parts.append('<h2>Chapter %i</h2>' % i)
+        for j in xrange(8):
+            parts.append('<p>%s</p>' % words(60 + j * 5, i + j))
+    css = '''
+        @page { size: A4; margin: 2cm }
+        body { font-size: 11pt; line-height: 1.4 }
+        p { text-align: justify; text-indent: 1em; margin: 0 0 .5em }
+    '''
+    return ''.join(parts), css
+
+
+def letter_spacing(scale):
+    """About 200 pages of paragraphs with letter and word spacing."""
+    parts = []
+    for i in xrange(scaled(1500, scale)):
+        parts.append('<p>%s</p>' % words(50, i))
+    css = '''
+        @page { size: A4; margin: 2cm }
+        body { font-size: 11pt; letter-spacing: 1px }
+        p:nth-child(2n) { word-spacing: 3px }
+    '''
+    return ''.join(parts), css
+
+
+def inline_markup(scale):
+    """About 300 pages of paragraphs with many short inline elements."""
+    tags = ('em', 'strong', 'a', 'code', 'span')
+    parts = []
+    for i in xrange(scaled(3000, scale)):
+        parts.append('<p>%s</p>' % ' '.join(
+            '%s <%s>%s</%s>' % (words(2, i + j), tags[j % 5], words(1, j),
+                                tags[j % 5])
+            for j in xrange(20)))
+    css = '''
+        @page { size: A4; margin: 2cm }
+        body { font-size: 11pt }
+        code { font-family: monospace }
+    '''
+    return ''.join(parts), css
+
+
+def _table(rows, layout):
+    cells = ''.join('<td>%s</td>' % words(3, i) for i in xrange(4))
+    row = '<tr>%s<td>%%i</td></tr>' % cells
+    html = '<table><thead><tr>%s</tr></thead><tbody>%s</tbody></table>' % (
+        ''.join('<th>Column %i</th>' % i for i in xrange(5)),
+        ''.join(row % i for i in xrange(rows)))
+    css = '''
+        @page { size: A4; margin: 1cm }
+        table { width: 100%%; table-layout: %s; border-collapse: separate }
+        td, th { border: 1px solid; padding: 2px }
+    ''' % layout
+    return html, css
+
+
+def table_fixed(scale):
+    """A table with 20 000 rows and ``table-layout: fixed``."""
+    return _table(scaled(20000, scale), 'fixed')
+
+
+def table_auto(scale):
+    """A table with 20 000 rows and ``table-layout: auto``."""
+    return _table(scaled(20000, scale), 'auto')
+
+
+def floats(scale):
+    """A magazine-like layout with many floated images and sidebars."""
+    article = '''
+        <article>
+            <h2>Title %(i)i</h2>
+            <img src="pattern.png" class="%(side)s">
+            <aside>%(aside)s</aside>
+            <p>%(text)s</p><p>%(text)s</p>
+            <div class="column">%(column)s</div>
+            <div class="column">%(column)s</div>
+            <div class="clear"></div>
+        </article>
+    '''
+    html = ''.join(article % dict(
+        i=i, side='left' if i % 2 else 'right', aside=words(20, i),
+        text=words(80, i), column=words(40, i + 1))
+        for i in xrange(scaled(400, scale)))
+    css = '''
+        @page { size: A4; margin: 1.5cm }
+        img { width: 3cm; height: 2cm; margin: 4px }
+        .left { float: left }
+        .right { float: right }
+        aside { float: right; width: 30%; font-size: 80%; margin: 0 0 4px 4px }
+        .column { float: left; width: 48%; margin-right: 2% }
+        .clear { clear: both }
+    '''
+    return html, css
+
+
+def selectors(scale):
+    """A stylesheet with 10 000 rules, most of them not matching."""
+    rules = []
+    for i in xrange(scaled(10000, scale)):
+        kind = i % 5
+        if kind == 0:
+            selector = '.class%i' % i
+        elif kind == 1:
+            selector = '#id%i' % i
+        elif kind == 2:
+            selector = 'div.class%i > p' % i
+        elif kind == 3:
+            selector = 'section p:first-child + p.class%i' % i
+        else:
+            selector = '[data-index="%i"] em' % i
+        rules.append('%s { color: #%06x }' % (selector, i))
+    sections = []
+    for i in xrange(scaled(200, scale)):
+        sections.append(
+            '<section><div class="class%i" id="id%i" data-index="%i">'
+            '<p>%s</p><p class="class%i">%s <em>%s</em></p></div>'
+            '</section>' % (i * 5, i * 5 + 1, i * 5 + 4, words(30, i),
+                            i * 5 + 3, words(30, i + 1), words(3, i)))
+    return ''.join(sections), '\n'.join(rules)
+
+
+def images(scale):
+    """Pages with the same PNG, SVG and JPEG images repeated."""
+    page = '''
+        <div class="page">
+            <img src="pattern.png"><img src="pattern.svg">
+            <img src="blue.jpg"><img src="logo_small.png">
+            <p style="background: url(pattern.png)">%s</p>
+        </div>
+    '''
+    html = ''.join(page % words(50, i) for i in xrange(scaled(300, scale)))
+    css = '''
+        @page { size: A4; margin: 1cm }
+        .page { page-break-after: always }
+        img { width: 4cm; height: 4cm; margin: 2px }
+    '''
+    return html, css
+
+
+def nested_lists(scale):
+    """Lists nested 30 levels deep, repeated."""
+    depth = 30
+
+    def nested(level):
+        if level == depth:
+            return ''
+        return '<ul><li>%s</li><li>%s%s</li></ul>' % (
+            words(5, level), words(8, level + 1), nested(level + 1))
+    html = nested(0) * scaled(100, scale)
+    css = '''
+        @page { size: A4; margin: 1cm }
+        ul { margin: 0; padding-left: 6px }
+        li:nth-child(2n) { list-style-type: square }
+    '''
+    return html, css
+
+
+def nested_tables(scale):
+    """Auto-layout tables nested 6 levels deep in floats, repeated."""
+    depth = 6
+
+    def nested(level):
+        if level == depth:
+            return words(4, level)
+        return ('<table><tr><td>%s</td><td>%s</td></tr></table>'
+                % (words(3, level), nested(level + 1)))
+    html = ''.join('<div>%s</div>' % nested(0)
+                   for _ in xrange(scaled(200, scale)))
+    css = '''
+        @page { size: A4; margin: 1cm }
+        div { float: left; margin: 2px }
+        td { border: 1px solid; padding: 1px }
+    '''
+    return html, css
+
+
+def fixed_header(scale):
+    """1 000 short pages with a fixed header and footer repeated on each.
+
+    The layout time should grow linearly with ``scale``.
+
+    """
+    html = '<header>%s</header><footer>%s</footer>%s' % (
+        words(5), words(3, 5), ''.join(
+            '<section>%s</section>' % words(20, i)
+            for i in xrange(scaled(1000, scale))))
+    css = '''
+        @page { size: A6; margin: 2cm 1cm }
+        header, footer { position: fixed; left: 0; right: 0; height: 1cm }
+        header { top: -1.5cm }
+        footer { bottom: -1.5cm }
+        section { page-break-after: always }
+    '''
+    return html, css
+
+
+#: name -> function, in the order they are run
+BENCHMARKS = [
+    ('long_text', long_text),
+    ('inline_markup', inline_markup),
+    ('letter_spacing', letter_spacing),
+    ('table_fixed', table_fixed),
+    ('table_auto', table_auto),
+    ('floats', floats),
+    ('selectors', selectors),
+    ('images', images),
+    ('nested_lists', nested_lists),
+    ('fixed_header', fixed_header),
+    ('nested_tables', nested_tables),
+]
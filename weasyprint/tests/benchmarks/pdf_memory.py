@@ -0,0 +1,104 @@
+# coding: utf8
+"""
+    weasyprint.tests.benchmarks.pdf_memory
+    --------------------------------------
+
+    Compare the peak memory used by ``write_pdf`` for the different kinds
+    of targets: no target (the PDF is returned as a byte string),
+    a filename, and a non-seekable file object like a pipe.
+
+    Usage: python -m weasyprint.tests.benchmarks.pdf_memory [PAGES]
+
+    Each measure runs in a new process as the peak resident set size
+    never goes down. Results are printed as JSON, in kilobytes.
+
+    :copyright: Copyright 2011-2012 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals, print_function
+
+import os
+import sys
+import json
+import resource
+import tempfile
+import subprocess
+
+from weasyprint import HTML, CSS
+
+
+TARGETS = ['bytes', 'filename', 'pipe']
+
+
+class Pipe(object):
+    """A file-like object that can only be written to."""
+    def __init__(self, file_obj):
+        self.write = file_obj.write
+
+
+def make_html(pages):
+    # About 50 paragraphs per A4 page, with an image on every page
+    # so that the PDF is not mostly text.
+    paragraph = '<p>%s</p>' % ' '.join(['Lorem ipsum dolor sit amet'] * 8)
+    page = paragraph * 50 + '<img src="pattern.png" style="width: 10cm">'
+    return page * pages
+
+
+def peak_rss():
+    """Peak resident set size of this process, in kilobytes."""
+    # ru_maxrss is in bytes on Mac OS, kilobytes elsewhere.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def measure(target_type, pages):
+    """Run in a child process: lay out, then write the PDF."""
+    resources = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'resources')
+    html = HTML(string=make_html(pages),
+                base_url=os.path.join(resources, 'dummy.html'))
+    document = html._get_document(
+        [CSS(string='@page { size: A4 }')], enable_hinting=False)
+    document.pages  # Lay out before measuring
+    before = peak_rss()
+
+    if target_type == 'bytes':
+        size = len(document.write_pdf())
+    else:
+        fd, filename = tempfile.mkstemp(suffix='.pdf')
+        os.close(fd)
+        try:
+            if target_type == 'filename':
+                document.write_pdf(filename)
+            else:
+                with open(filename, 'wb') as file_obj:
+                    document.write_pdf(Pipe(file_obj))
+            size = os.path.getsize(filename)
+        finally:
+            os.remove(filename)
+
+    return {'target': target_type, 'pages': len(document.pages),
+            'pdf_size': size // 1024, 'peak_rss_before_pdf': before,
+            'peak_rss_after_pdf': peak_rss()}
+
+
+def main(argv=sys.argv):
+    if len(argv) > 2 and argv[1] == '--child':
+        print(json.dumps(measure(argv[2], int(argv[3]))))
+        return
+    pages = argv[1] if len(argv) > 1 else '200'
+    results = []
+    for target_type in TARGETS:
+        # No subprocess.check_output() on Python 2.6
+        process = subprocess.Popen([
+            sys.executable, '-m', 'weasyprint.tests.benchmarks.pdf_memory',
+            '--child', target_type, pages], stdout=subprocess.PIPE)
+        output, _ = process.communicate()
+        results.append(json.loads(output.decode('ascii')))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# coding: utf8
+"""
+    weasyprint.tests.benchmarks.run
+    -------------------------------
+
+    Render the documents in :mod:`.documents` and report, as JSON,
+    the time of each rendering stage, the peak memory allocated by Python
+    (with tracemalloc, when available) and the size of the PDF output.
+    Memory is measured in a second rendering: tracing allocations slows
+    down the timed one.
+
+    Usage::
+
+        python -m weasyprint.tests.benchmarks.run [--scale 0.1]
+            [--output results.json] [--baseline baseline.json]
+            [benchmark_name ...]
+
+    With ``--baseline``, compare with the results of a previous run and
+    exit with status 1 if some time or size grew more than ``--tolerance``.
+
+    :copyright: Copyright 2011-2012 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals, print_function
+
+import io
+import os
+import sys
+import json
+import argparse
+import logging
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:  # Python < 3.4
+    tracemalloc = None
+
+from weasyprint import HTML, CSS, LOGGER
+from .documents import BENCHMARKS
+
+
+RESOURCES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources')
+
+
+def render(html, css):
+    """Render a document to PDF, return the document and the PDF bytes."""
+    document = HTML(string=html, base_url=os.path.join(
+        RESOURCES, 'dummy.html'))._get_document(
+            [CSS(string=css)], enable_hinting=False)
+    output = io.BytesIO()
+    document.write_pdf(output)
+    return document, output
+
+
+def run_benchmark(function, scale):
+    """Render the document of a benchmark and return its results."""
+    html, css = function(scale)
+    start = default_timer()
+    document, output = render(html, css)
+    total = default_timer() - start
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            render(html, css)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    else:
+        peak_memory = None
+    stats = document.stats.as_dict()
+    return {
+        'seconds': total,
+        'stages': dict((name, timing['seconds'])
+                       for name, timing in stats['timings'].items()),
+        'counters': stats['counters'],
+        'peak_memory': peak_memory,
+        'output_size': len(output.getvalue()),
+        'pages': len(document.pages),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of messages for values that grew too much."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        values = [('seconds', result['seconds'], old['seconds']),
+                  ('output_size', result['output_size'],
+                   old['output_size']),
+                  ('peak_memory', result['peak_memory'],
+                   old.get('peak_memory'))]
+        values.extend(
+            ('stages.' + stage, seconds, old['stages'].get(stage))
+            for stage, seconds in sorted(result['stages'].items()))
+        for key, new_value, old_value in values:
+            if new_value is None or not old_value:
+                continue
+            if new_value > old_value * (1 + tolerance):
+                regressions.append('%s %s: %.4g -> %.4g (+%i%%)' % (
+                    name, key, old_value, new_value,
+                    (new_value / old_value - 1) * 100))
+    return regressions
+
+
+def main(argv=None):
+    names = [name for name, _ in BENCHMARKS]
+    parser = argparse.ArgumentParser(
+        description='Run the WeasyPrint benchmarks.')
+    parser.add_argument('-s', '--scale', type=float, default=1,
+                        help='Size of the documents, 1 for the full size.')
+    parser.add_argument('-o', '--output',
+                        help='Also write the results to this JSON file.')
+    parser.add_argument('-b', '--baseline',
+                        help='JSON results of a previous run to compare to.')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                        help='Allowed relative growth compared to '
+                             'the baseline. Default: 0.1')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help='Names of the benchmarks to run, among %s. '
+                             'Default: all.' % ', '.join(names))
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in names:
+            parser.error('Unknown benchmark: %s' % name)
+
+    # Keep warnings about the generated documents out of the results.
+    LOGGER.setLevel(logging.ERROR)
+
+    results = {}
+    for name, function in BENCHMARKS:
+        if args.benchmarks and name not in args.benchmarks:
+            continue
+        print('Running %s...' % name, file=sys.stderr)
+        results[name] = run_benchmark(function, args.scale)
+    results = {'scale': args.scale, 'benchmarks': results}
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(output)
+
+    if args.baseline:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)
+        if baseline['scale'] != args.scale:
+            parser.error('The baseline was run with --scale %s'
+                         % baseline['scale'])
+        regressions = compare(
+            results['benchmarks'], baseline['benchmarks'], args.tolerance)
+        for message in regressions:
+            print('Regression: ' + message, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# coding: utf8
+"""
+    weasyprint.tests.benchmarks.startup
+    -----------------------------------
+
+    Measure the time taken by new processes to import WeasyPrint, show
+    the command-line help, and load the user-agent stylesheet with an empty
+    (cold) or filled (warm) cache.
+
+    Usage: python -m weasyprint.tests.benchmarks.startup [REPEAT]
+
+    Results are printed as JSON, in seconds (the best of REPEAT runs).
+
+    :copyright: Copyright 2011-2012 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals, print_function
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from timeit import default_timer
+
+
+LOAD_UA_STYLESHEET = (
+    'from weasyprint.html import get_ua_stylesheet; get_ua_stylesheet()')
+
+COMMANDS = [
+    ('python', ['-c', 'pass']),
+    ('import_weasyprint', ['-c', 'import weasyprint']),
+    ('cli_help', ['-m', 'weasyprint', '--help']),
+    ('ua_stylesheet_cold', ['-c', LOAD_UA_STYLESHEET]),
+    ('ua_stylesheet_warm', ['-c', LOAD_UA_STYLESHEET]),
+]
+
+
+def run(arguments, cache_directory):
+    """Return the time taken by a new Python process."""
+    environ = dict(os.environ, XDG_CACHE_HOME=cache_directory)
+    start = default_timer()
+    process = subprocess.Popen([sys.executable] + arguments, env=environ,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process.communicate()
+    assert process.returncode == 0, arguments
+    return default_timer() - start
+
+
+def main(argv=sys.argv):
+    repeat = int(argv[1]) if len(argv) > 1 else 5
+    results = {}
+    for name, arguments in COMMANDS:
+        times = []
+        for _ in range(repeat):
+            cache_directory = tempfile.mkdtemp()
+            try:
+                if name == 'ua_stylesheet_warm':
+                    run(arguments, cache_directory)  # Fill the cache
+                times.append(run(arguments, cache_directory))
+            finally:
+                shutil.rmtree(cache_directory)
+        results[name] = min(times)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
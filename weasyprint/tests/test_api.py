@@ -18,19 +18,37 @@ import sys
 import contextlib
 import threading
 import shutil
+import time
+import logging
 import tempfile
+from multiprocessing.pool import ThreadPool
 
+import cairo
 import pystacia
 import lxml.html
 import pytest
 
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
 from .testing_utils import (
-    resource_filename, assert_no_logs, capture_logs, TEST_UA_STYLESHEET)
+    resource_filename, assert_no_logs, capture_logs, TEST_UA_STYLESHEET,
+    TestPDFDocument)
 from ..compat import urljoin, urlencode, urlparse_uses_relative
-from ..urls import path2url
-from .. import HTML, CSS, default_url_fetcher
+from ..urls import path2url, ConnectionPool, HTTPCache, limit_fetch_time
+from .. import HTML, CSS, LOGGER, default_url_fetcher
 from .. import __main__
 from .. import navigator
+from .. import stats
+from ..document import map_pages
+from .. import png
+from .. import images
+from .. import urls
+from ..cache import LRUCache
 
 
 CHDIR_LOCK = threading.Lock()
@@ -73,6 +91,54 @@ def write_file(filename, content):
         fd.write(content)
 
 
+@contextlib.contextmanager
+def http_server(responses):
+    """Serve ``responses``, a dict of path -> (status, headers, body),
+    on a local port.
+
+    Yield ``(base_url, connections, requests)``, where ``connections`` is
+    a list of the client addresses of accepted connections and
+    ``requests`` a list of ``(path, headers)`` tuples.
+
+    """
+    connections = []
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = str('HTTP/1.1')  # Keep connections open
+
+        def setup(self):
+            connections.append(self.client_address)
+            BaseHTTPRequestHandler.setup(self)
+
+        def do_GET(self):
+            requests.append((self.path, dict(self.headers.items())))
+            status, headers, body = responses[self.path]
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # Keep the output of tests clean
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield ('http://127.0.0.1:%i/' % server.server_address[1],
+               connections, requests)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 class TestHTML(HTML):
     """Like HTML, but with the testing (smaller) UA stylesheet"""
     def _ua_stylesheet(self):
@@ -259,6 +325,20 @@ def test_python_render():
         assert read_file(png_filename) == png_bytes
         assert read_file(pdf_filename) == pdf_bytes
 
+        # Seekable and readable: the PDF is updated in place,
+        # and replaces any previous content.
+        with open(pdf_filename, 'wb') as pdf_file:
+            pdf_file.write(b'a' * 2 * len(pdf_bytes))
+        with open(pdf_filename, 'r+b') as pdf_file:
+            html.write_pdf(pdf_file, stylesheets=[css])
+        assert read_file(pdf_filename) == pdf_bytes
+
+        # Not at the start of the file: write a copy after the existing data.
+        with open(pdf_filename, 'w+b') as pdf_file:
+            pdf_file.write(b'abc')
+            html.write_pdf(pdf_file, stylesheets=[css])
+        assert read_file(pdf_filename) == b'abc' + pdf_bytes
+
     x2_png_bytes = html.write_png(stylesheets=[css], resolution=192)
     check_png_pattern(x2_png_bytes, x2=True)
 
@@ -268,6 +348,21 @@ def test_python_render():
     assert pages == [(16, 16, x2_png_bytes)]
 
 
+@assert_no_logs
+def test_hinting_resolution():
+    """Test that all lines of a paragraph are hinted for the resolution."""
+    css = CSS(string='''
+        @page { size: 100px 80px; margin: 0; background: #fff }
+        body, p { margin: 0; font-size: 13px; line-height: 20px }
+    ''')
+    paragraph = TestHTML(string='<p style="width: 1px">Lorem ipsum dolor</p>')
+    lines = TestHTML(string='<p>Lorem</p><p>ipsum</p><p>dolor</p>')
+    for resolution in [96, 150, 192]:
+        assert paragraph.write_png(
+            stylesheets=[css], resolution=resolution) == lines.write_png(
+            stylesheets=[css], resolution=resolution)
+
+
 @assert_no_logs
 def test_command_line_render():
     """Test rendering with the command-line API."""
@@ -486,3 +581,367 @@ def test_url_fetcher():
         test('<body><img src="custom:foo/bar">', blank=True)
     assert len(logs) == 1
     assert logs[0].startswith('WARNING: Error for image at custom:foo/bar')
+
+
+@assert_no_logs
+def test_connection_pool():
+    """Test keeping HTTP connections open between fetches."""
+    responses = {
+        '/style.css': (200, {'Content-Type': 'text/css; charset=utf-8'},
+                       b'p { color: red }'),
+        '/old.css': (301, {'Location': '/style.css'}, b''),
+        '/missing.css': (404, {}, b''),
+    }
+    with http_server(responses) as (base_url, connections, _requests):
+        pool = ConnectionPool(max_connections=2)
+        for _ in range(3):
+            assert default_url_fetcher(
+                base_url + 'style.css', connection_pool=pool) == dict(
+                    string=b'p { color: red }', mime_type='text/css',
+                    encoding='utf-8', redirected_url=base_url + 'style.css')
+        result = default_url_fetcher(base_url + 'old.css', pool)
+        assert result['redirected_url'] == base_url + 'style.css'
+        with pytest.raises(IOError):
+            default_url_fetcher(base_url + 'missing.css', pool)
+        assert pool.connections_opened == 1
+        assert len(connections) == 1
+
+        # Idle connections are not reused after the timeout.
+        pool.idle_timeout = 0
+        default_url_fetcher(base_url + 'style.css', pool)
+        assert pool.connections_opened == 2
+        assert len(connections) == 2
+        pool.close()
+
+        # Each document has its own pool by default.
+        html = TestHTML(string='<link rel=stylesheet href=style.css>'
+                               '<link rel=stylesheet href=old.css>',
+                        base_url=base_url)
+        document = html._get_document([], enable_hinting=False)
+        assert document.style_for(html.root_element) is not None
+        assert len(connections) == 3
+        # Its idle connections are closed after layout.
+        assert document._connection_pool._idle
+        document.pages
+        assert not document._connection_pool._idle
+
+
+@assert_no_logs
+def test_http_cache():
+    """Test keeping HTTP responses on disk."""
+    responses = {
+        '/fresh.css': (200, {'Cache-Control': 'max-age=60'}, b'a {}'),
+        '/etag.css': (200, {'Cache-Control': 'no-cache', 'ETag': '"v1"'},
+                      b'b {}'),
+        '/no-store.css': (200, {'Cache-Control': 'no-store, max-age=60'},
+                          b'c {}'),
+    }
+    with temp_directory() as directory:
+        with http_server(responses) as (base_url, _connections, requests):
+            pool = ConnectionPool()
+
+            def fetch(cache):
+                for name, body in [('fresh', b'a {}'), ('etag', b'b {}'),
+                                   ('no-store', b'c {}')]:
+                    url = base_url + name + '.css'
+                    result = cache.fetch(url, pool)
+                    assert result['string'] == body
+                    assert result['redirected_url'] == url
+
+            fetch(HTTPCache(directory))
+            assert len(requests) == 3
+            assert len(os.listdir(directory)) == 2
+
+            # Like in a new process
+            responses['/etag.css'] = (304, {}, b'')
+            fetch(HTTPCache(directory))
+            assert [path for path, _ in requests[3:]] == [
+                '/etag.css', '/no-store.css']
+            assert requests[3][1]['If-None-Match'] == '"v1"'
+
+            # The least recently used responses are removed.
+            sizes = [os.path.getsize(os.path.join(directory, name))
+                     for name in os.listdir(directory)]
+            fetch(HTTPCache(directory, max_size=max(sizes)))
+            assert len(os.listdir(directory)) == 1
+
+
+@assert_no_logs
+def test_document_stats():
+    """Test the timings and counters of a document."""
+    stats.count('pango_layouts')  # No current document: ignored
+    document = TestPDFDocument(
+        '<p>a<img src=pattern.png><img src=pattern.png></p>',
+        base_url=resource_filename('<inline HTML>'))
+    document.write_pdf()
+    document.write_pdf()
+    timings = document.stats.timings
+    assert sorted(timings) == ['cascaded_styles', 'formatting_structure',
+                               'pages', 'pdf_metadata', 'write_pdf']
+    # Lazy properties are only computed once.
+    assert timings['cascaded_styles'][0] == 1
+    assert timings['pages'][0] == 1
+    assert timings['write_pdf'][0] == 2
+    assert timings['write_pdf'][1] >= timings['pages'][1]
+    counters = document.stats.counters
+    assert counters['pages_laid_out'] == 1
+    assert counters['image_fetches'] == 1  # The second image is cached
+    assert counters['pango_layouts'] > 0
+
+    as_dict = document.stats.as_dict()
+    assert as_dict['counters'] == counters
+    assert as_dict['timings']['pages']['calls'] == 1
+
+    with capture_logs() as logs:
+        level = LOGGER.level
+        LOGGER.setLevel(logging.DEBUG)
+        try:
+            document.write_pdf()
+        finally:
+            LOGGER.setLevel(level)
+    assert len(logs) == 1
+    assert logs[0].startswith('DEBUG: Rendering statistics: timings: ')
+
+
+@assert_no_logs
+def test_prefetch():
+    """Test fetching stylesheets and images concurrently before rendering."""
+    lock = threading.Lock()
+    fetched = []
+    running = [0, 0]  # Current and maximum number of concurrent fetches
+
+    def fetcher(url):
+        if url.startswith('data:'):
+            return default_url_fetcher(url)
+        with lock:
+            fetched.append(url.rsplit('/', 1)[-1])
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return default_url_fetcher(url)
+
+    html = TestHTML(string='''
+        <link rel=stylesheet href=sheet2.css>
+        <img src=pattern.png><img src=pattern.png><img src=blue.jpg>
+        <p style="background: url(logo_small.png)">
+        <link rel=stylesheet href="data:text/css,">
+        <div style="display: none">
+          <p style="background: url(icon.png)"><img src=pattern.gif></p>
+        </div>
+    ''', base_url=resource_filename('<inline HTML>'), url_fetcher=fetcher)
+    document = html._get_document([], enable_hinting=False,
+                                  prefetch_workers=2)
+    # Images in the styles of display: none elements are not prefetched.
+    assert sorted(fetched) == [
+        'blue.jpg', 'logo_small.png', 'pattern.gif', 'pattern.png',
+        'sheet2.css']
+    assert running[1] == 2
+    assert document.stats.counters['prefetched_urls'] == 5
+    assert 'prefetch' in document.stats.timings
+
+    # Prefetched resources are not fetched again, unused ones are dropped.
+    document.write_pdf()
+    assert len(fetched) == 5
+    assert document.stats.counters['image_fetches'] == 3
+    assert not document._url_fetcher._results
+
+
+@assert_no_logs
+def test_image_cache():
+    """Test sharing decoded images between documents."""
+    html = '<p><img src=pattern.png><img src=pattern.png></p>'
+    base_url = resource_filename('<inline HTML>')
+    cache = LRUCache(max_size=1000)
+    previous_cache = images.IMAGE_CACHE
+    images.IMAGE_CACHE = cache
+    try:
+        for _ in range(2):
+            document = TestPDFDocument(html, base_url=base_url)
+            document.write_pdf()
+    finally:
+        images.IMAGE_CACHE = previous_cache
+    # Fetched again to check the content, but not decoded.
+    assert document.stats.counters['image_fetches'] == 1
+    assert document.stats.counters['image_cache_hits'] == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.size == 4 * 4 * 4  # 4x4 pixels, 4 bytes each
+
+
+@assert_no_logs
+def test_failed_images():
+    """Test caching failures to fetch images."""
+    responses = {'/logo.png': (404, {}, b'Not found')}
+    failed_cache = LRUCache()
+    previous_cache = images.FAILED_IMAGES_CACHE
+    images.FAILED_IMAGES_CACHE = failed_cache
+    try:
+        with http_server(responses) as (base_url, _connections, requests):
+            for i in range(2):
+                html = TestHTML(
+                    string='<p><img src=logo.png><img src=logo.png>',
+                    base_url=base_url)
+                document = html._get_document([], enable_hinting=False)
+                with capture_logs() as logs:
+                    document.formatting_structure
+                if i == 0:
+                    # Only once per document
+                    assert len(logs) == 1
+                    assert logs[0].startswith(
+                        'WARNING: Error for image at %slogo.png' % base_url)
+                else:
+                    # Not fetched again, no other warning
+                    assert not logs
+            assert len(requests) == 1
+        assert document.stats.counters['failed_image_hits'] == 1
+        assert len(failed_cache) == 1
+
+        # Errors of other fetchers and of fetch time budgets are not cached
+        def fetcher(url):
+            raise IOError('Unreachable host')
+        failed_cache.clear()
+        with capture_logs() as logs:
+            TestHTML(string='<img src=logo.png>', url_fetcher=fetcher,
+                     base_url='http://example.invalid/').write_png()
+        assert len(logs) == 1
+        previous_budget = urls.FETCH_TIME_BUDGET
+        urls.FETCH_TIME_BUDGET = 0
+        try:
+            with capture_logs() as logs:
+                TestHTML(string='<img src=logo.png>',
+                         base_url='http://example.invalid/').write_png()
+        finally:
+            urls.FETCH_TIME_BUDGET = previous_budget
+        assert len(logs) == 1
+        assert 'budget' in logs[0]
+        assert len(failed_cache) == 0
+    finally:
+        images.FAILED_IMAGES_CACHE = previous_cache
+
+
+@assert_no_logs
+def test_fetch_time_budget():
+    """Test limiting the total time spent fetching."""
+    def slow_fetcher(url):
+        time.sleep(0.02)
+        return default_url_fetcher(url)
+
+    fetcher = limit_fetch_time(slow_fetcher, 0.01)
+    assert fetcher('data:,a')['string'] == b'a'
+    with pytest.raises(IOError):
+        fetcher('data:,b')
+
+
+@assert_no_logs
+def test_png_workers():
+    """Test drawing pages in parallel."""
+    def slow_square(number):
+        # Make early pages finish last
+        time.sleep((10 - number) / 1000)
+        return number ** 2
+    for workers in [None, 1, 3]:
+        assert list(map_pages(slow_square, range(10), workers)) == [
+            number ** 2 for number in range(10)]
+
+    html = TestHTML(string='''
+        <style>
+            @page { size: 20px; margin: 2px }
+            div { height: 10px; background: #f00 }
+            div:nth-child(2n) { height: 15px; background: #00f }
+        </style>
+        <img src=pattern.png><div></div><div></div><div></div><div></div>
+    ''', base_url=resource_filename('dummy.html'))
+    pages = list(html.get_png_pages())
+    assert len(pages) > 2
+    assert list(html.get_png_pages(workers=3)) == pages
+    assert html.write_png(workers=3) == html.write_png()
+
+
+@assert_no_logs
+def test_parallel_documents():
+    """Test rendering documents in parallel threads."""
+    # Images are shared by pages and documents with the same extends or
+    # filters set differently, fixed boxes share their layouts.
+    template = '''
+        <style>
+            @page { size: 100px 60px; margin: 2px }
+            body { font-size: %(size)ipx; letter-spacing: %(spacing)ipx }
+            td { border: 1px solid }
+            .fixed { position: fixed; bottom: 0; right: 0 }
+            .repeat { background: url(pattern.png) repeat-x;
+                      image-rendering: optimizeSpeed; height: 8px }
+            .no-repeat { background: url(pattern.png) no-repeat;
+                         height: 8px }
+        </style>
+        <div class=fixed>%(number)i</div>
+        <p style="orphans: 2; widows: 3">%(text)s</p>
+        <div class=repeat></div>
+        <table><tr><td>%(number)i lorem</td><td>ipsum %(text)s</td></tr>
+        </table>
+        <img src=pattern.png style="width: 9px">
+        <div class=no-repeat></div><div class=repeat></div>
+        <div style="background: url(pattern.svg)">%(number)i</div>
+    '''
+    base_url = resource_filename('dummy.html')
+    sources = [
+        template % dict(size=6 + i % 3, spacing=i % 2, number=i,
+                        text=' '.join(['lorem ipsum dolor sit amet'] * i))
+        for i in range(12)]
+
+    def render(source):
+        return TestHTML(string=source, base_url=base_url).write_png()
+
+    previous_cache = images.IMAGE_CACHE
+    images.IMAGE_CACHE = cache = LRUCache()
+    try:
+        serial = [render(source) for source in sources]
+        pool = ThreadPool(4)
+        try:
+            parallel = pool.map(render, sources * 2)
+        finally:
+            pool.terminate()
+    finally:
+        images.IMAGE_CACHE = previous_cache
+    assert cache.hits > 0
+    assert parallel == serial * 2
+
+
+@assert_no_logs
+def test_write_png_bands():
+    """Test writing multiple pages to a PNG image one band at a time."""
+    html = TestHTML(string='''
+        <style>
+            @page { size: 7px 20px }
+            @page :first { size: 10px 20px; background: #0f0 }
+            body { margin: 0 }
+        </style>
+        <div style="height: 15px; background: url(pattern.png)"></div>
+        <div style="page-break-before: always; height: 12px;
+                    background: url(pattern.png) #00f"></div>
+    ''', base_url=resource_filename('dummy.html'))
+    document = html._get_document(None, enable_hinting=True)
+
+    # Composite all pages on a single surface
+    surfaces = list(document.get_png_surfaces())
+    assert len(surfaces) == 2
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 10, 40)
+    context = cairo.Context(surface)
+    for i, (width, height, page_surface) in enumerate(surfaces):
+        context.set_source_surface(page_surface, (10 - width) // 2, 20 * i)
+        context.paint()
+    expected = io.BytesIO()
+    surface.write_to_png(expected)
+
+    band_height = png.BAND_HEIGHT
+    png.BAND_HEIGHT = 3  # Test rows at the limit between bands
+    try:
+        png_bytes = document.write_png()
+    finally:
+        png.BAND_HEIGHT = band_height
+
+    def get_pixels(png_bytes):
+        with contextlib.closing(pystacia.read_blob(png_bytes)) as image:
+            assert image.size == (10, 40)
+            return image.get_raw('rgba')['raw']
+    assert get_pixels(png_bytes) == get_pixels(expected.getvalue())
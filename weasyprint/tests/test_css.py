@@ -13,15 +13,19 @@
 from __future__ import division, unicode_literals
 
 import os.path
+import shutil
+import tempfile
 
 from pytest import raises
 
 from .testing_utils import (
     resource_filename, assert_no_logs, capture_logs, TestPNGDocument)
 from .. import css
+from ..cache import LRUCache
 from ..css.computed_values import strut_layout
 from ..urls import open_data_url, path2url
 from .. import CSS, default_url_fetcher
+from .. import html
 
 
 def parse_html(filename, **kwargs):
@@ -77,6 +81,129 @@ def test_style_dict():
         style.position  # pylint: disable=W0104
 
 
+@assert_no_logs
+def test_inherit_from():
+    """Test the shared styles of anonymous boxes."""
+    style = css.computed_from_cascaded(
+        element=None, cascaded={}, parent_style=None)
+    anonymous = style.inherit_from()
+    assert anonymous.anonymous
+    assert anonymous.display == 'inline'
+    # Shared by all anonymous children, including those of copies
+    assert style.inherit_from() is anonymous
+    assert style.copy().inherit_from() is anonymous
+    assert anonymous.copy().anonymous
+    assert anonymous.copy().inherit_from() is anonymous.inherit_from()
+
+    # Modified copies get new anonymous styles
+    copy = style.copy()
+    copy.color = (1, 0, 0, 1)
+    copy.display = 'block'
+    modified = copy.inherit_from()
+    assert modified.color == (1, 0, 0, 1)
+    assert modified.display == 'inline'
+    assert copy.inherit_from() is modified
+    copy.color = (0, 0, 1, 1)
+    assert copy.inherit_from().color == (0, 0, 1, 1)
+    assert modified.color == (1, 0, 0, 1)
+    # ... without changing the original
+    assert style.color == (0, 0, 0, 1)
+    assert style.inherit_from() is anonymous
+
+
+@assert_no_logs
+def test_shared_computed_styles():
+    """Test that equal computed styles share their values."""
+    document = TestPNGDocument(
+        '<p>a</p><p>b</p><p style="color: red">c</p><p>d</p>')
+    p_1, p_2, p_3, p_4 = document.element_tree.iter('p')
+    style_1, style_2, style_3, style_4 = map(document.style_for, (
+        p_1, p_2, p_3, p_4))
+    assert style_1._parent is style_2._parent is style_4._parent
+    assert style_3._parent is not style_1._parent
+    assert style_3.color == (1, 0, 0, 1)
+
+    # Each element can still have its own modifications
+    style_1.color = (0, 0, 1, 1)
+    assert style_1.color == (0, 0, 1, 1)
+    assert style_2.color == (0, 0, 0, 1)
+    assert style_1.copy().color == (0, 0, 1, 1)
+    assert style_2.copy().color == (0, 0, 0, 1)
+
+
+@assert_no_logs
+def test_style_sharing():
+    """Test that siblings with the same cascaded styles share computing."""
+    document = TestPNGDocument('''
+        <style>
+            li:after { content: attr(title) }
+            em:after { content: "!" }
+        </style>
+        <ul><li title=a>1</li><li title=b>2</li><li title=c>3</li></ul>
+        <p><em>1</em><em>2</em><em>3</em><a href="#a">a</a><a href="#b">b</a>
+    ''')
+    document.computed_styles
+    # <p> like <body>, 2 <li>, 2 <em>, 2 em:after
+    assert document.stats.counters['shared_computed_styles'] == 7
+    elements = list(document.element_tree.iter('li', 'em', 'a'))
+    li_1, li_2, li_3, em_1, em_2, em_3, a_1, a_2 = elements
+    assert document.style_for(li_1)._parent is document.style_for(
+        li_2)._parent
+    assert document.style_for(li_1) is not document.style_for(li_2)
+    assert document.style_for(em_1, 'after').content == [('STRING', '!')]
+    # Values that depend on the element itself are not shared
+    assert [document.style_for(li, 'after').content
+            for li in (li_1, li_2, li_3)] == [
+        [('STRING', 'a')], [('STRING', 'b')], [('STRING', 'c')]]
+    assert [document.style_for(a).link for a in (a_1, a_2)] == [
+        ('internal', 'a'), ('internal', 'b')]
+
+
+@assert_no_logs
+def test_lazy_computed_styles():
+    """Test that styles are only computed for rendered elements."""
+    document = TestPNGDocument('''
+        <style>p:before { content: "a" }</style>
+        <div style="display: none"><p>a</p><p>b</p></div>
+        <p>c</p>
+    ''')
+    div, p_1, p_2, p_3 = document.element_tree.iter('div', 'p')
+    # Ancestors are computed first
+    assert document.style_for(p_3, 'before').content == [('STRING', 'a')]
+    assert document.style_for(p_3).display == 'block'
+    assert document.style_for(p_3, 'after') is None
+    document.formatting_structure
+    computed = document._style_for.computed_styles
+    assert (div, None) in computed
+    assert (p_1, None) not in computed
+    assert (p_1, 'before') not in computed
+
+    # Eager mode computes everything
+    assert document.computed_styles[p_1, None].display == 'block'
+    assert document.computed_styles[p_2, 'before'].content == [
+        ('STRING', 'a')]
+    assert document.style_for(p_1) is document.computed_styles[p_1, None]
+    assert document.stats.timings['computed_styles'][0] == 1
+
+
+@assert_no_logs
+def test_lazy_inherited_table_styles():
+    """Test that values not applying to table boxes are still inherited."""
+    document = TestPNGDocument('''
+        <table style="border-collapse: collapse; padding: 3px">
+          <caption style="padding-left: inherit">a</caption>
+          <tr><td style="margin-left: 5px">
+            <p style="margin-left: inherit">b</p>
+    ''')
+    document.formatting_structure
+    table, caption, td, p = document.element_tree.iter(
+        'table', 'caption', 'td', 'p')
+    assert document.style_for(table).padding_left == (3, 'px')
+    assert document.style_for(caption).padding_left == (3, 'px')
+    assert document.style_for(td).margin_left == (5, 'px')
+    assert document.style_for(p).margin_left == (5, 'px')
+
+
 @assert_no_logs
 def test_find_stylesheets():
     """Test if the stylesheets are found in a HTML document."""
@@ -101,6 +228,183 @@ def test_find_stylesheets():
     ]
 
 
+@assert_no_logs
+def test_rule_index():
+    """Test the selectors candidates for each element."""
+    sheet = CSS(string='''
+        p { color: red }
+        .a, #b, div { display: block }
+        * { margin-top: 0 }
+        div > p.a:first-child:after, p:not(.c) { float: left }
+        @page { margin: 0 }
+    ''')
+    index = sheet.rule_index
+    assert sorted(index.buckets) == [
+        ('class', 'a'), ('id', 'b'), ('tag', 'div'), ('tag', 'p')]
+    assert len(index.universal) == 1
+    assert len(index.page_rules) == 1
+
+    document = TestPNGDocument(
+        '<div><p class="a c" id=b>1</p><p>2</p></div>')
+    first, second = document.element_tree.iter('p')
+
+    def matches(element):
+        return [(selector.pseudo_element, declarations[0][0])
+                for selector, declarations in index.match(element)]
+
+    # In source order
+    assert matches(first) == [
+        (None, 'color'), (None, 'display'), (None, 'display'),
+        (None, 'margin_top'), ('after', 'float')]
+    assert matches(second) == [
+        (None, 'color'), (None, 'margin_top'), (None, 'float')]
+
+
+@assert_no_logs
+def test_structural_pseudo_classes():
+    """Test pseudo-classes that depend on the position among siblings."""
+    document = TestPNGDocument('''
+        <div><h1 id=h></h1><p id=p1></p><p id=p2></p>
+          <ul><li id=l1><li id=l2><li id=l3><li id=l4><li id=l5></ul>
+          <p id=p3></p><em id=e></em></div>''')
+    elements = list(document.element_tree.iter())
+
+    def matching(selector):
+        index = CSS(string='%s { color: red }' % selector).rule_index
+        return [element.get('id') for element in elements
+                if list(index.match(element))]
+
+    assert matching('p:first-child') == []
+    assert matching('h1:first-child') == ['h']
+    assert matching('li:last-child') == ['l5']
+    assert matching('p:last-child') == []
+    assert matching('li:nth-child(2n+1)') == ['l1', 'l3', 'l5']
+    assert matching('li:nth-child(even)') == ['l2', 'l4']
+    assert matching('li:nth-child(-n+2)') == ['l1', 'l2']
+    assert matching('p:nth-child(2)') == ['p1']
+    assert matching('li:nth-last-child(2)') == ['l4']
+    assert matching('p:first-of-type') == ['p1']
+    assert matching('p:last-of-type') == ['p3']
+    assert matching('p:nth-of-type(2)') == ['p2']
+    assert matching('em:only-of-type') == ['e']
+    assert matching('li:only-child') == []
+    assert matching('ul > li:first-child + li') == ['l2']
+
+
+@assert_no_logs
+def test_stylesheet_cache():
+    """Test the process-wide cache of preprocessed stylesheets."""
+    cache = LRUCache(max_entries=2, max_size=1000)
+    previous_cache = css.STYLESHEET_CACHE
+    css.STYLESHEET_CACHE = cache
+    try:
+        sheet_1 = CSS(string='p { color: blue }', base_url='http://a/')
+        sheet_2 = CSS(string='p { color: blue }', base_url='http://a/')
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert sheet_2.rules is sheet_1.rules
+        assert sheet_2.rule_index is sheet_1.rule_index
+
+        # Different source, base URL or source type
+        CSS(string='p { color: red }', base_url='http://a/')
+        CSS(string='p { color: blue }', base_url='http://b/')
+        CSS(string=b'p { color: blue }', base_url='http://a/')
+        assert (cache.hits, cache.misses) == (1, 4)
+        assert len(cache) == 2
+
+        # <style> and <link> elements
+        html = '<style>p { color: red }</style><link rel=stylesheet href=%s>'
+        document = TestPNGDocument(
+            html % path2url(resource_filename('sheet2.css')),
+            base_url='http://b/')
+        for _ in range(2):
+            sheets = list(css.find_stylesheets(
+                document.element_tree, 'print', default_url_fetcher))
+            assert len(sheets) == 2
+        assert (cache.hits, cache.misses) == (3, 6)
+
+        # Too big
+        CSS(string='p { color: blue }' * 100)
+        CSS(string='p { color: blue }' * 100)
+        assert (cache.hits, cache.misses) == (3, 8)
+        assert cache.size <= 1000
+
+        # Imported stylesheets are fetched for every new sheet
+        fetched = []
+        def url_fetcher(url):
+            fetched.append(url)
+            return dict(string=b'li { color: red }', mime_type='text/css')
+        for _ in range(2):
+            sheet = CSS(string='@import "b.css"; p { color: blue }',
+                        base_url='http://a/', url_fetcher=url_fetcher)
+            assert [rule.selector.as_css()
+                    for rule, _, _ in sheet.rules] == ['li', 'p']
+        assert fetched == ['http://a/b.css', 'http://a/b.css']
+    finally:
+        css.STYLESHEET_CACHE = previous_cache
+
+
+@assert_no_logs
+def test_stylesheet_disk_cache():
+    """Test saving preprocessed stylesheets between processes."""
+    source = '''
+        p, #foo > em { color: blue }
+        li:nth-child(2n+1) { margin: 0 }
+        @page :left { margin: 1cm; @top-center { content: "a" } }
+    '''
+    directory = tempfile.mkdtemp()
+    try:
+        sheet_1 = CSS(string=source, _cache_directory=directory)
+        assert len(os.listdir(directory)) == 1
+        sheet_2 = CSS(string=source, _cache_directory=directory)
+        assert sheet_1.stylesheet is not None
+        assert sheet_2.stylesheet is None  # Loaded from the disk
+
+        document = TestPNGDocument(
+            '<p id=foo><em></em></p><ul><li><li><li></ul>')
+        elements = list(document.element_tree.iter())
+
+        def matches(sheet):
+            return [
+                [(selector.specificity, declarations)
+                 for selector, declarations in sheet.rule_index.match(element)]
+                for element in elements
+            ] + [
+                (selector.pseudo_element, selector.match(document))
+                for selector_list, _ in sheet.rule_index.page_rules
+                for selector in selector_list]
+        assert matches(sheet_2) == matches(sheet_1)
+        assert [element.tag for element in elements
+                if list(sheet_2.rule_index.match(element))] == [
+            'p', 'em', 'li', 'li']
+        assert matches(sheet_2)[len(elements):] == [
+            (None, ['left_page', 'first_left_page']),
+            ('@top-center', ['left_page', 'first_left_page'])]
+
+        # Not saved with @import rules
+        CSS(string='@import "data:text/css,a{}"; p { color: red }',
+            _cache_directory=directory)
+        assert len(os.listdir(directory)) == 1
+
+        # Not loaded by another version of the code or of the libraries
+        assert css.get_cache_version() is not None
+        css._cache_version[:] = ['other version']
+        try:
+            sheet_3 = CSS(string=source, _cache_directory=directory)
+        finally:
+            del css._cache_version[:]
+        assert sheet_3.stylesheet is not None
+        assert len(os.listdir(directory)) == 2
+    finally:
+        shutil.rmtree(directory)
+
+
+@assert_no_logs
+def test_html5_ua_stylesheet():
+    """Test the lazy alias for the user-agent stylesheet."""
+    assert isinstance(html.HTML5_UA_STYLESHEET, CSS)
+    assert html.HTML5_UA_STYLESHEET.rules is html.get_ua_stylesheet().rules
+
+
 @assert_no_logs
 def test_expand_shorthands():
     """Test the expand shorthands."""
@@ -18,8 +18,10 @@ from .testing_utils import (
 from ..formatting_structure import boxes
 from ..layout.inlines import split_inline_box
 from ..layout.percentages import resolve_percentages
+from ..layout import LayoutContext
 from ..layout.preferred import (inline_preferred_width,
-                                inline_preferred_minimum_width)
+                                inline_preferred_minimum_width,
+                                preferred_width, preferred_minimum_width)
 
 
 def body_children(page):
@@ -1744,6 +1746,26 @@ def test_orphans_widows_avoid():
     assert line_distribution(
         'orphans: 2; widows: 2; page-break-inside: avoid') == [0, 7]
 
+    # Lines split before the page break is moved are reused, the text
+    # is only shaped once for both pages.
+    document = parse('''
+        <style>
+            @page { size: 200px }
+            h1 { height: 120px }
+            p { line-height: 20px; width: 1px; orphans: 2; widows: 4 }
+        </style>
+        <h1>Tasty test</h1>
+        <p>one two three four five six seven</p>
+    ''', return_document=True)
+    page_1, page_2 = document.pages
+    layouts = set()
+    for paragraph in body_children(page_1)[1:] + body_children(page_2):
+        for line in paragraph.children:
+            text, = line.children
+            layouts.add(text.pango_layout)
+    assert len(layouts) == 1
+    assert document.stats.counters['reused_line_breaks'] > 6
+
 
 @assert_no_logs
 def test_table_page_breaks():
@@ -3382,6 +3404,32 @@ def test_preferred_widths():
     assert 120 < minimum < 140
     assert 220 < preferred < 240
 
+    # Cached for each box in a layout context
+    context = LayoutContext(document.enable_hinting, document.style_for,
+                            document.get_image_from_uri)
+    with document.stats.stage('preferred_widths'):
+        for hits in range(3):
+            assert document.stats.counters.get(
+                'preferred_width_hits', 0) == 2 * hits
+            assert preferred_minimum_width(
+                context, line, outer=False) == minimum
+            assert preferred_width(context, line, outer=False) == preferred
+
+    # Nested shrink-to-fit boxes reuse the widths of their descendants,
+    # and give the same layout every time.
+    widths = []
+    for _ in range(2):
+        document = parse('''
+            <table><tr><td><table><tr><td>
+              <div style="float: left">Lorem ipsum dolor sit amet</div>
+            </td></tr></table></td></tr></table>
+        ''', return_document=True)
+        page, = document.pages
+        assert document.stats.counters['preferred_width_hits'] > 0
+        table_wrapper, = body_children(page)
+        widths.append(table_wrapper.width)
+    assert widths[0] == widths[1] > 0
+
 
 @assert_no_logs
 def test_margin_boxes_variable_dimension():
@@ -4093,6 +4141,86 @@ def test_absolute_images():
     # TODO: test the various cases in absolute_replaced()
 
 
+@assert_no_logs
+def test_fixed_positioning():
+    """Test that fixed boxes are repeated on every page."""
+    pages = parse('''
+        <style>
+            @page { size: 100px; margin: 0 }
+            article { height: 20px }
+            article + article { page-break-before: always }
+            #fixed { position: fixed; top: 10px; left: 5px; width: 20px }
+            img { display: block }
+        </style>
+        <article><div id="fixed"><img src=pattern.png></div></article>
+        <article></article>
+        <article></article>
+    ''')
+    page_1, page_2, page_3 = pages
+    html, = page_1.children
+    body, = html.children
+    article, = body.children
+    fixed_boxes = list(article.children)
+    for page in (page_2, page_3):
+        html, = page.children
+        fixed, body = html.children
+        article, = body.children
+        assert article.children == ()
+        fixed_boxes.append(fixed)
+    images = []
+    for fixed in fixed_boxes:
+        assert fixed.element_tag == 'div'
+        assert (fixed.position_x, fixed.position_y) == (5, 10)
+        assert (fixed.width, fixed.height) == (20, 4)
+        img, = fixed.children
+        assert (img.position_x, img.position_y) == (5, 10)
+        images.append(img)
+    # Every page has its own boxes
+    assert len(set(id(img) for img in images)) == 3
+
+    # The box is laid out once for all the other pages with the same size
+    document = parse('''
+        <style>@page { size: 100px; margin: 0 }</style>
+        <div style="position: fixed"></div>
+    ''' + '<p style="page-break-after: always"></p>' * 9 + '<p></p>',
+        return_document=True)
+    assert len(document.pages) == 10
+    assert document.stats.counters['fixed_box_layouts'] == 1
+
+    # Each page geometry gets its own descendants, absolute boxes included
+    pages = parse('''
+        <style>
+            @page { size: 100px; margin: 0 }
+            @page :left { margin-left: 50px }
+            article { height: 20px }
+            article + article { page-break-before: always }
+            #fixed { position: fixed; top: 0; left: 0; width: 40px }
+            #absolute { position: absolute; top: 5px; left: 10px;
+                        width: 5px; height: 5px }
+        </style>
+        <article><div id="fixed"><div id="absolute"></div></div></article>
+        <article></article>
+        <article></article>
+    ''')
+    page_1, page_2, page_3 = pages
+    html, = page_1.children
+    body, = html.children
+    article, = body.children
+    fixed_boxes = list(article.children)
+    for page in (page_2, page_3):
+        html, = page.children
+        fixed, body = html.children
+        fixed_boxes.append(fixed)
+    absolute_boxes = []
+    for fixed, x in zip(fixed_boxes, (0, 50, 0)):
+        assert fixed.element_tag == 'div'
+        assert (fixed.position_x, fixed.position_y) == (x, 0)
+        absolute, = fixed.children
+        assert (absolute.position_x, absolute.position_y) == (x + 10, 5)
+        absolute_boxes.append(absolute)
+    assert len(set(id(absolute) for absolute in absolute_boxes)) == 3
+
+
 @assert_no_logs
 def test_floats():
     # adjacent-floats-001
@@ -13,31 +13,36 @@
 from __future__ import division, unicode_literals
 
 import io
+import tempfile
 
 import cairo
+from pytest import raises
 
 from .. import CSS
 from .. import pdf
+from .. import images
 from .testing_utils import (
     assert_no_logs, resource_filename, TestPDFDocument, capture_logs)
 
 
 @assert_no_logs
 def test_pdf_parser():
-    fileobj = io.BytesIO()
-    surface = cairo.PDFSurface(fileobj, 1, 1)
-    for width, height in [
-        (100, 100),
-        (200, 10),
-        (3.14, 987654321)
-    ]:
-        surface.set_size(width, height)
-        surface.show_page()
-    surface.finish()
-
-    sizes = [page.get_value('MediaBox', '\[(.+?)\]').strip()
-             for page in pdf.PDFFile(fileobj).pages]
-    assert sizes == [b'0 0 100 100', b'0 0 200 10', b'0 0 3.14 987654321']
+    # Spooled temporary files are not iterators, unlike BytesIO.
+    for fileobj in [io.BytesIO(), tempfile.SpooledTemporaryFile()]:
+        surface = cairo.PDFSurface(fileobj, 1, 1)
+        for width, height in [
+            (100, 100),
+            (200, 10),
+            (3.14, 987654321)
+        ]:
+            surface.set_size(width, height)
+            surface.show_page()
+        surface.finish()
+
+        sizes = [page.get_value('MediaBox', '\[(.+?)\]').strip()
+                 for page in pdf.PDFFile(fileobj).pages]
+        assert sizes == [
+            b'0 0 100 100', b'0 0 200 10', b'0 0 3.14 987654321']
 
 
 def get_metadata(html, base_url=resource_filename('<inline HTML>')):
@@ -274,3 +279,23 @@ def test_missing_links():
     assert links == [[('internal', (0, 50, 935), (50, 950, 450, 935))]]
     assert len(logs) == 1
     assert 'WARNING: No anchor #missing for internal URI reference' in logs[0]
+
+
+@assert_no_logs
+def test_jpeg_pass_through():
+    """Test that JPEG images are embedded in PDF without re-encoding."""
+    with open(resource_filename('blue.jpg'), 'rb') as fd:
+        jpeg_bytes = fd.read()
+    assert images.get_jpeg_size(jpeg_bytes) == (4, 4)
+    with raises(ValueError):
+        images.get_jpeg_size(b'\x89PNG\r\n\x1a\n')
+
+    document = TestPDFDocument(
+        '<img src=blue.jpg><div style="background: url(blue.jpg)">a</div>',
+        base_url=resource_filename('<inline HTML>'))
+    pdf_bytes = document.write_pdf()
+    assert b'/DCTDecode' in pdf_bytes
+    assert jpeg_bytes in pdf_bytes
+    if images.MIME_TYPE_UNIQUE_ID is not None:
+        # Both uses share a single embedded image
+        assert pdf_bytes.count(jpeg_bytes) == 1
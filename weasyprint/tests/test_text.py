@@ -18,7 +18,9 @@ import cairo
 
 from ..css import StyleDict
 from ..css.properties import INITIAL_VALUES
-from ..text import split_first_line
+from ..text import (split_first_line, ParagraphLayout, line_widths,
+                    min_content_width, units_from_double, _spacing_attributes)
+from ..formatting_structure import boxes
 from .test_layout import parse, body_children
 from .testing_utils import FONTS, assert_no_logs
 
@@ -26,13 +28,18 @@ from .testing_utils import FONTS, assert_no_logs
 FONTS = FONTS.split(', ')
 
 
-def make_text(text, width=None, **style):
-    """Wrapper for split_first_line() creating a StyleDict."""
-    style = StyleDict({
+def make_style(**style):
+    """Create a StyleDict with a monospace font."""
+    return StyleDict({
         'font_family': ['Nimbus Mono L', 'Liberation Mono', 'FreeMono',
                         'monospace'],
     }, INITIAL_VALUES).updated_copy(style)
-    return split_first_line(text, style, hinting=False, max_width=width)
+
+
+def make_text(text, width=None, **style):
+    """Wrapper for split_first_line() creating a StyleDict."""
+    return split_first_line(
+        text, make_style(**style), hinting=False, max_width=width)
 
 
 @assert_no_logs
@@ -72,6 +79,58 @@ def test_line_breaking():
     assert string[resume_at:] == 'text for test'
 
 
+@assert_no_logs
+def test_paragraph_layout():
+    """Test that lines from a single layout are the same as first lines."""
+    text = 'Le café est très bon. ' * 10 + 'Fin\nDe ligne'
+    style = make_style(font_family=FONTS, font_size=19)
+    paragraph = ParagraphLayout(text, style, hinting=False, max_width=100)
+    position = 0
+    for index in range(100):
+        assert paragraph.line_index(position) == index
+        (byte_length, byte_resume_at, length, resume_at, width, height,
+            baseline) = paragraph.get_line(index)
+        _, first_length, first_resume_at, first_width, first_height, \
+            first_baseline = make_text(
+                text[position:], 100, font_family=FONTS, font_size=19)
+        assert byte_length == first_length
+        assert byte_resume_at == first_resume_at
+        assert len(text[position:][:length].encode('utf8')) == byte_length
+        assert (width, height, baseline) == (
+            first_width, first_height, first_baseline)
+        if resume_at is None:
+            break
+        position += resume_at
+    assert text[position:] == 'De ligne'
+    assert index > 5
+    assert paragraph.line_index(position + 1) is None
+
+    paragraph = ParagraphLayout(text, style, hinting=False, max_width=100,
+                                offset=position)
+    assert paragraph.line_index(position) == 0
+    _, _, length, resume_at, _, _, _ = paragraph.get_line(0)
+    assert (length, resume_at) == (8, None)
+
+
+@assert_no_logs
+def test_min_content_width():
+    """Test that cached word widths give the same widths as layouts."""
+    for text, style in [
+            ('EUR 12.50 paid', {}),
+            ('EUR 12.50 paid ', {}),
+            ('Invoice paid', {'font_size': 30}),
+            ('paid', {}),
+            ('paid', {'font_weight': 700}),
+            ('a-very-long-word and more', {}),  # Not cached
+            ('EUR 12.50', {'letter_spacing': 2}),  # Not cached
+            ]:
+        style = make_style(font_family=FONTS, **style).inherit_from()
+        box = boxes.TextBox('p', 1, style, text)
+        expected = max(line_widths(box, enable_hinting=False, width=0))
+        for _ in range(2):
+            assert min_content_width(box, enable_hinting=False) == expected
+
+
 @assert_no_logs
 def test_text_dimension():
     """Test the font size impact on the text dimension."""
@@ -82,6 +141,54 @@ def test_text_dimension():
     assert width_1 * height_1 < width_2 * height_2
 
 
+@assert_no_logs
+def test_text_spacing():
+    """Test letter and word spacing, with attributes shared by layouts."""
+    def width(**style):
+        _, _, _, width, _, _ = make_text(
+            'Le café est très bon', font_family=FONTS, font_size=20, **style)
+        return width
+
+    normal = width()
+    letter_spacing = width(letter_spacing=2)
+    word_spacing = width(word_spacing=10)
+    assert normal < letter_spacing < width(letter_spacing=2, word_spacing=10)
+    assert normal < word_spacing
+    # Again, with cached attributes
+    assert width(letter_spacing=2) == letter_spacing
+    assert width(word_spacing=10) == word_spacing
+
+    # Attributes are cached by length, not by text
+    _spacing_attributes.clear()
+    make_text('Le café', letter_spacing=2)
+    make_text('Du café', letter_spacing=2)
+    make_text('Le thé est très bon', word_spacing=10)
+    assert list(_spacing_attributes) == [(8, units_from_double(2))]
+
+
+@assert_no_logs
+def test_text_justified():
+    """Test justified lines, laid out again with word spacing."""
+    document = parse('''
+        <style>
+            p { width: 200px; font-family: %(fonts)s; font-size: 20px;
+                text-align: justify }
+        </style>
+        <p>%(text)s</p>
+    ''' % {'fonts': FONTS[0], 'text': 'Lorem ipsum dolor sit amet. ' * 5},
+        return_document=True)
+    page, = document.pages
+    paragraph, = body_children(page)
+    lines = paragraph.children
+    assert len(lines) > 2
+    for line in lines[:-1]:
+        text, = line.children
+        assert text.style.word_spacing > 0
+    text, = lines[-1].children
+    assert text.style.word_spacing == 0
+    assert document.write_png()
+
+
 @assert_no_logs
 def test_text_font_size_zero():
     """Test a text with a font size set to 0."""
@@ -97,3 +204,21 @@ def test_text_font_size_zero():
     assert not line.children
     assert line.height == 0
     assert paragraph.height == 0
+
+
+@assert_no_logs
+def test_text_box_lines_share_layout():
+    """Test that the lines of a text box are taken from a single layout."""
+    page, = parse('''
+        <style>
+            p { width: 200px; font-family: %(fonts)s; font-size: 20px }
+        </style>
+        <p>%(text)s</p>
+    ''' % {'fonts': FONTS[0], 'text': 'Lorem ipsum dolor sit amet. ' * 20})
+    paragraph, = body_children(page)
+    lines = paragraph.children
+    assert len(lines) > 5
+    text_boxes = [line.children[0] for line in lines]
+    assert len(set(id(box.pango_layout) for box in text_boxes)) == 1
+    assert [box.pango_line_index for box in text_boxes] == list(
+        range(len(lines)))
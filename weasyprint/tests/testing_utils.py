@@ -13,17 +13,25 @@
 from __future__ import division, unicode_literals, print_function
 
 import sys
+import atexit
+import shutil
 import os.path
 import logging
+import tempfile
 import contextlib
 import functools
 
 from .. import HTML, CSS
+from .. import html
 from ..document import Document
 from ..logger import LOGGER
 from ..urls import default_url_fetcher
 
 
+# Do not read or write the user-agent stylesheet in the user’s cache.
+html.UA_CACHE_DIRECTORY = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, html.UA_CACHE_DIRECTORY, True)
+
 # TODO: find a way to not depend on a specific font
 FONTS = 'Liberation Sans, Arial'
 
@@ -13,12 +13,15 @@
 from __future__ import division, unicode_literals
 
 import os
+import re
+import threading
 from cgi import escape
 
 import cairo
 
-from .compat import xrange, basestring
+from .compat import xrange, basestring, iteritems
 from .logger import LOGGER
+from .stats import count
 
 
 USING_INTROSPECTION = bool(os.environ.get('WEASYPRINT_USE_INTROSPECTION'))
@@ -54,17 +57,48 @@ if USING_INTROSPECTION:
         _, attributes_list, _, _ = Pango.parse_markup(markup, -1, '\x00')
         return attributes_list
 
+    def make_spacing_attributes(text, letter_spacing, word_spacing):
+        """Return a Pango AttrList for spacings in Pango units.
+
+        Attributes can not be created with introspection before Pango
+        1.44, go through markup.
+
+        """
+        markup = escape(text)
+        if word_spacing:
+            markup = markup.replace(
+                ' ', '<span letter_spacing="%i"> </span>' % (
+                    word_spacing + letter_spacing,))
+        markup = '<span letter_spacing="%i">%s</span>' % (
+            letter_spacing, markup)
+        return parse_markup(markup)
+
     def get_size(line):
         _ink_extents, logical_extents = line.get_extents()
         return (units_to_double(logical_extents.width),
                 units_to_double(logical_extents.height))
 
-    def show_first_line(cairo_context, pango_layout, hinting):
-        """Draw the given ``line`` to the Cairo ``context``."""
+    def iter_lines(layout):
+        """Yield ``(line, baseline)`` for each line of ``layout``.
+
+        ``baseline`` is in Pango units from the top of the line.
+
+        """
+        layout_iter = layout.get_iter()
+        while 1:
+            top, _bottom = layout_iter.get_line_yrange()
+            yield (layout_iter.get_line_readonly(),
+                   layout_iter.get_baseline() - top)
+            if not layout_iter.next_line():
+                return
+
+    def show_line(cairo_context, pango_layout, line_index, style, hinting):
+        """Draw the given line of ``pango_layout`` to the Cairo ``context``."""
+        line = pango_layout.get_line_readonly(line_index)
         if hinting:
-            PangoCairo.update_layout(cairo_context, pango_layout)
-        lines = pango_layout.get_lines_readonly()
-        PangoCairo.show_layout_line(cairo_context, lines[0])
+            line = copy_line(
+                cairo_context, pango_layout, line, style).get_line_readonly(0)
+        PangoCairo.show_layout_line(cairo_context, line)
 
 else:
     import pango as Pango
@@ -89,22 +123,118 @@ else:
         attributes_list, _, _ = Pango.parse_markup(markup, '\x00')
         return attributes_list
 
+    def make_spacing_attributes(text, letter_spacing, word_spacing):
+        """Return a Pango AttrList for spacings in Pango units."""
+        utf8_text = text.encode('utf8')
+        attributes = Pango.AttrList()
+        attributes.insert(
+            Pango.AttrLetterSpacing(letter_spacing, 0, len(utf8_text)))
+        if word_spacing:
+            # The attribute starting closest to a character applies to it:
+            # this one replaces the previous one for spaces.
+            space_spacing = word_spacing + letter_spacing
+            position = utf8_text.find(b' ')
+            while position != -1:
+                attributes.insert(Pango.AttrLetterSpacing(
+                    space_spacing, position, position + 1))
+                position = utf8_text.find(b' ', position + 1)
+        return attributes
+
     def get_size(line):
         _ink_extents, logical_extents = line.get_extents()
         _x, _y, width, height = logical_extents
         return units_to_double(width), units_to_double(height)
 
-    def show_first_line(cairo_context, pango_layout, hinting):
-        """Draw the given ``line`` to the Cairo ``context``."""
+    def iter_lines(layout):
+        """Yield ``(line, baseline)`` for each line of ``layout``.
+
+        ``baseline`` is in Pango units from the top of the line.
+
+        """
+        layout_iter = layout.get_iter()
+        while 1:
+            top, _bottom = layout_iter.get_line_yrange()
+            yield layout_iter.get_line(), layout_iter.get_baseline() - top
+            if not layout_iter.next_line():
+                return
+
+    def show_line(cairo_context, pango_layout, line_index, style, hinting):
+        """Draw the given line of ``pango_layout`` to the Cairo ``context``."""
         context = pangocairo.CairoContext(cairo_context)
+        line = pango_layout.get_line(line_index)
         if hinting:
-            context.update_layout(pango_layout)
-        context.show_layout_line(pango_layout.get_line(0))
+            line = copy_line(
+                cairo_context, pango_layout, line, style).get_line(0)
+        context.show_layout_line(line)
+
+
+def copy_line(cairo_context, pango_layout, line, style):
+    """Return a new layout for ``cairo_context`` with the text of ``line``,
+    a line of ``pango_layout``.
+
+    With hinting, metrics depend on the font options and scale of the
+    context used to draw. Layouts are shared by pages drawn in parallel
+    threads (eg. fixed boxes and text boxes split across pages): updating
+    them for a given cairo context is not safe, lay out the text again
+    instead. Only the text of the line is laid out, so that the text drawn
+    is the one kept when breaking lines, whatever the number of lines in
+    ``pango_layout``.
+
+    """
+    text = pango_layout.get_text()
+    if not isinstance(text, bytes):
+        text = text.encode('utf8')
+    text = text[line.start_index:line.start_index + line.length]
+    return create_layout(
+        text.decode('utf8'), style, hinting=True, max_width=None,
+        context=cairo_context)
+
+
+# cairo contexts must not be used by multiple threads at the same time.
+# Pango layouts are created from these, so keep a pair for each thread.
+# (PangoCairo also has a default font map for each thread.)
+_dummy_contexts = threading.local()
+
+
+def get_dummy_context(hinting):
+    """Return a cairo context for this thread to create Pango layouts."""
+    try:
+        return (_dummy_contexts.hinted if hinting
+                else _dummy_contexts.non_hinted)
+    except AttributeError:
+        _dummy_contexts.non_hinted = cairo.Context(
+            cairo.PDFSurface(None, 1, 1))
+        _dummy_contexts.hinted = cairo.Context(cairo.ImageSurface(
+            cairo.FORMAT_ARGB32, 1, 1))
+        return get_dummy_context(hinting)
+
+
+# Texts made of these characters only have line break opportunities after
+# spaces, see UAX #14. Breaking them at every opportunity gives one word
+# (and its trailing space) per line.
+SIMPLE_WORDS_RE = re.compile(
+    r"^[A-Za-z0-9.,:;'\"&()]+( [A-Za-z0-9.,:;'\"&()]+)* ?$")
+
+#: Maximum number of words in the cache of :func:`min_content_width`.
+#: The cache is emptied when full.
+MAX_CACHED_WORDS = 10000
 
+# (font_key, hinting, word) -> width, see min_content_width
+_word_widths = {}
 
-NON_HINTED_DUMMY_CONTEXT = cairo.Context(cairo.PDFSurface(None, 1, 1))
-HINTED_DUMMY_CONTEXT = cairo.Context(cairo.ImageSurface(
-    cairo.FORMAT_ARGB32, 1, 1))
+#: Maximum number of attribute lists in the cache of spacing attributes.
+#: The cache is emptied when full.
+MAX_CACHED_ATTRIBUTES = 1000
+
+# font_key -> Pango.FontDescription
+_font_descriptions = {}
+
+# (length of the text in UTF-8 bytes, letter_spacing) -> Pango.AttrList
+_spacing_attributes = {}
+
+# Documents can be laid out in parallel threads: lock changes to the caches
+# above. Cached Pango objects are never changed once in a cache.
+_caches_lock = threading.Lock()
 
 
 def units_from_double(value):
@@ -116,7 +246,35 @@ def units_to_double(value):
     return value / Pango.SCALE
 
 
-def create_layout(text, style, hinting, max_width):
+def font_key(style):
+    """Return a hashable key for the font properties of ``style``."""
+    return (tuple(style.font_family), style.font_variant, style.font_style,
+            style.font_size, style.font_weight)
+
+
+def get_font_description(style):
+    """Return a Pango FontDescription for ``style``, shared by all styles
+    with the same font properties.
+
+    """
+    key = font_key(style)
+    font = _font_descriptions.get(key)
+    if font is None:
+        assert not isinstance(style.font_family, basestring), (
+            'font_family should be a list')
+        font = Pango.FontDescription()
+        font.set_family(','.join(style.font_family))
+        font.set_variant(PANGO_VARIANT[style.font_variant])
+        font.set_style(PANGO_STYLE[style.font_style])
+        font.set_absolute_size(units_from_double(style.font_size))
+        font.set_weight(style.font_weight)
+        # Layouts copy their font description: this one is never changed.
+        with _caches_lock:
+            font = _font_descriptions.setdefault(key, font)
+    return font
+
+
+def create_layout(text, style, hinting, max_width, context=None):
     """Return an opaque Pango object to be passed to other functions
     in this module.
 
@@ -126,19 +284,14 @@ def create_layout(text, style, hinting, max_width):
     :param max_width:
         The maximum available width in the same unit as ``style.font_size``,
         or ``None`` for unlimited width.
+    :param context:
+        The cairo context to lay out the text for, or ``None`` for a dummy
+        context, see :func:`get_dummy_context`.
 
     """
-    layout = create_pango_layout(
-        HINTED_DUMMY_CONTEXT if hinting else NON_HINTED_DUMMY_CONTEXT)
-    font = Pango.FontDescription()
-    assert not isinstance(style.font_family, basestring), (
-        'font_family should be a list')
-    font.set_family(','.join(style.font_family))
-    font.set_variant(PANGO_VARIANT[style.font_variant])
-    font.set_style(PANGO_STYLE[style.font_style])
-    font.set_absolute_size(units_from_double(style.font_size))
-    font.set_weight(style.font_weight)
-    layout.set_font_description(font)
+    count('pango_layouts')
+    layout = create_pango_layout(context or get_dummy_context(hinting))
+    layout.set_font_description(get_font_description(style))
     layout.set_wrap(PANGO_WRAP_WORD)
     set_text(layout, text)
     # Make sure that max_width * Pango.SCALE == max_width * 1024 fits in a
@@ -150,17 +303,105 @@ def create_layout(text, style, hinting, max_width):
     if letter_spacing == 'normal':
         letter_spacing = 0
     if text and (word_spacing != 0 or letter_spacing != 0):
-        word_spacing = units_from_double(word_spacing)
         letter_spacing = units_from_double(letter_spacing)
-        markup = escape(text).replace(
-            ' ', '<span letter_spacing="%i"> </span>' % (
-                word_spacing + letter_spacing,))
-        markup = '<span letter_spacing="%i">%s</span>' % (
-            letter_spacing, markup)
-        layout.set_attributes(parse_markup(markup))
+        word_spacing = units_from_double(word_spacing)
+        if word_spacing:
+            # Attributes depend on the position of spaces. Texts with word
+            # spacing (eg. justified lines) are rarely laid out again: do
+            # not keep them in the cache.
+            attributes = make_spacing_attributes(
+                text, letter_spacing, word_spacing)
+        else:
+            # Letter spacing applies to the whole text: attributes only
+            # depend on its length.
+            key = (len(text.encode('utf8')), letter_spacing)
+            attributes = _spacing_attributes.get(key)
+            if attributes is None:
+                attributes = make_spacing_attributes(text, letter_spacing, 0)
+                with _caches_lock:
+                    if len(_spacing_attributes) >= MAX_CACHED_ATTRIBUTES:
+                        _spacing_attributes.clear()
+                    attributes = _spacing_attributes.setdefault(
+                        key, attributes)
+        # Layouts do not change their attributes, they can be shared.
+        layout.set_attributes(attributes)
     return layout
 
 
+class ParagraphLayout(object):
+    """Lines of a text shaped once for a given available width.
+
+    The text is wrapped in a single Pango layout and successive lines are
+    handed out from this layout, so that a long paragraph is not shaped again
+    for every line.
+
+    :param text: Unicode, the whole text of a text box
+    :param offset:
+        Number of Unicode code points to skip at the start of ``text``.
+        Lines start at or after this offset.
+
+    Other parameters are the same as for :func:`create_layout`.
+
+    """
+    def __init__(self, text, style, hinting, max_width, offset=0):
+        self.text = text
+        self.max_width = max_width
+        self.layout = create_layout(
+            text[offset:], style, hinting, max_width)
+        self._utf8_text = utf8_text = text[offset:].encode('utf8')
+        # (pango_line, byte_start, char_start, baseline) for each line,
+        # starts being relative to ``offset``.
+        self._lines = []
+        # Start of each line from the start of ``text``, in code points,
+        # mapped to the line index.
+        self._line_starts = {}
+        byte_start = char_start = 0
+        for index, (line, baseline) in enumerate(iter_lines(self.layout)):
+            start_index = line.start_index
+            char_start += len(utf8_text[byte_start:start_index].decode('utf8'))
+            byte_start = start_index
+            self._lines.append((line, byte_start, char_start, baseline))
+            self._line_starts[offset + char_start] = index
+
+    def line_index(self, position):
+        """Return the index of the line starting at ``position``, or ``None``.
+
+        ``position`` is in Unicode code points from the start of the text.
+
+        """
+        return self._line_starts.get(position)
+
+    def iter_line_starts(self):
+        """Yield ``(position, index)`` for each line, see
+        :meth:`line_index`.
+
+        """
+        return iteritems(self._line_starts)
+
+    def get_line(self, index):
+        """Return ``(byte_length, byte_resume_at, length, resume_at,
+        width, height, baseline)`` for the line at ``index``.
+
+        Lengths and ``resume_at`` positions are relative to the start of
+        the line, in UTF-8 bytes for the ``byte_`` values and in Unicode
+        code points for the others. See :func:`split_first_line`.
+
+        """
+        line, byte_start, char_start, baseline = self._lines[index]
+        byte_length = line.length
+        length = len(self._utf8_text[
+            byte_start:byte_start + byte_length].decode('utf8'))
+        if index + 1 < len(self._lines):
+            _, next_byte_start, next_char_start, _ = self._lines[index + 1]
+            byte_resume_at = next_byte_start - byte_start
+            resume_at = next_char_start - char_start
+        else:
+            byte_resume_at = resume_at = None
+        width, height = get_size(line)
+        return (byte_length, byte_resume_at, length, resume_at,
+                width, height, units_to_double(baseline))
+
+
 def split_first_line(*args, **kwargs):
     """Fit as much as possible in the available width for one line of text.
 
@@ -178,16 +419,9 @@ def split_first_line(*args, **kwargs):
                    newline characters.
 
     """
-    layout = create_layout(*args, **kwargs)
-    first_line = layout.get_line(0)
-    length = first_line.length
-    width, height = get_size(first_line)
-    baseline = units_to_double(layout.get_iter().get_baseline())
-    if layout.get_line_count() >= 2:
-        resume_at = layout.get_line(1).start_index
-    else:
-        resume_at = None
-    return layout, length, resume_at, width, height, baseline
+    paragraph = ParagraphLayout(*args, **kwargs)
+    length, resume_at, _, _, width, height, baseline = paragraph.get_line(0)
+    return paragraph.layout, length, resume_at, width, height, baseline
 
 
 def line_widths(box, enable_hinting, width, skip=None):
@@ -199,3 +433,50 @@ def line_widths(box, enable_hinting, width, skip=None):
     for i in xrange(layout.get_line_count()):
         width, _height = get_size(layout.get_line(i))
         yield width
+
+
+def min_content_width(box, enable_hinting):
+    """Return the width of the widest line of ``box`` when breaking
+    at every line break opportunity.
+
+    For simple texts without letter or word spacing, this is the width of
+    the widest word. Words are measured once and cached for each font.
+    Other texts are measured with :func:`line_widths`.
+
+    """
+    text = box.text.lstrip()
+    style = box.style
+    if (style.word_spacing != 0 or style.letter_spacing not in ('normal', 0)
+            or not SIMPLE_WORDS_RE.match(text)):
+        return max(line_widths(box, enable_hinting, width=0))
+    words = text.split(' ')
+    # Lines keep their trailing space
+    words = [word + ' ' for word in words[:-1]] + (
+        [words[-1]] if words[-1] else [])
+    key = font_key(style), enable_hinting
+    widths = {}
+    missing = []
+    for word in set(words):
+        width = _word_widths.get((key, word))
+        if width is None:
+            missing.append(word)
+        else:
+            widths[word] = width
+    if missing:
+        # Measure all missing words in a single layout, one per line. Only
+        # the last word of the text may have no trailing space.
+        missing.sort(key=lambda word: not word.endswith(' '))
+        layout = create_layout(''.join(missing), style, enable_hinting, 0)
+        if layout.get_line_count() != len(missing):  # pragma: no cover
+            # Unexpected line breaks, do not trust the cache
+            return max(line_widths(box, enable_hinting, width=0))
+        for i, word in enumerate(missing):
+            widths[word], _height = get_size(layout.get_line(i))
+        with _caches_lock:
+            if len(_word_widths) + len(missing) > MAX_CACHED_WORDS:
+                _word_widths.clear()
+            for word in missing:
+                _word_widths[key, word] = widths[word]
+    else:
+        count('min_content_width_hits')
+    return max(widths.values())
@@ -15,14 +15,23 @@ from __future__ import division, unicode_literals
 import io
 import re
 import sys
+import time
+import pickle
+import hashlib
 import os.path
+import tempfile
+import threading
 import mimetypes
+import email.utils
 
 from . import VERSION_STRING
 from .logger import LOGGER
+from .stats import count
 from .compat import (
     urljoin, urlsplit, quote, unquote, unquote_to_bytes, urlopen_contenttype,
-    Request, parse_email, pathname2url, unicode, base64_decode)
+    Request, parse_email, pathname2url, unicode, base64_decode, getproxies,
+    get_content_type, HTTPConnection, HTTPSConnection, HTTPException,
+    HTTPError)
 
 
 # Unlinke HTML, CSS and PNG, the SVG MIME type is not always builtin
@@ -39,6 +48,27 @@ else:
 UNICODE_SCHEME_RE = re.compile('^([a-z][a-z0-1.+-]+):', re.I)
 BYTES_SCHEME_RE = re.compile(b'^([a-z][a-z0-1.+-]+):', re.I)
 
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
+
+#: Process-wide :class:`ConnectionPool` used by :func:`default_url_fetcher`
+#: when no other pool is given, to keep connections open between documents.
+#: Disabled (``None``) by default: each :class:`Document` has its own pool.
+CONNECTION_POOL = None
+
+#: Timeout in seconds for each network operation of
+#: :func:`default_url_fetcher`, or ``None`` for the default of the
+#: :mod:`socket` module.
+FETCH_TIMEOUT = None
+
+#: Maximum total time in seconds spent fetching resources for a document,
+#: or ``None`` for no limit. Once it is spent, fetching fails immediately.
+FETCH_TIME_BUDGET = None
+
+#: :class:`HTTPCache` used by :func:`default_url_fetcher` to keep HTTP
+#: responses between documents and processes. Disabled (``None``) by default.
+HTTP_CACHE = None
+
 
 def iri_to_uri(url):
     """Turn an IRI that can contain any Unicode character into an ASII-only
@@ -194,7 +224,283 @@ def open_data_url(url):
                 redirected_url=url)
 
 
-def default_url_fetcher(url):
+def get_timeout_kwargs():
+    # Passing timeout=None would disable the default timeout.
+    return {} if FETCH_TIMEOUT is None else {'timeout': FETCH_TIMEOUT}
+
+
+def make_http_result(url, response, body):
+    """Return a result dict for an URL fetcher from an HTTP response."""
+    mime_type, charset = get_content_type(response.msg)
+    return dict(string=body, redirected_url=url, mime_type=mime_type,
+                encoding=charset)
+
+
+class ConnectionPool(object):
+    """Keep HTTP and HTTPS connections open between requests to a host.
+
+    :param max_connections:
+        The maximum number of idle connections kept for each host.
+    :param idle_timeout:
+        Idle connections older than this, in seconds, are closed instead
+        of being reused.
+
+    Instances can be shared between threads.
+
+    """
+    def __init__(self, max_connections=4, idle_timeout=30):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        #: Number of connections opened, for statistics and tests.
+        self.connections_opened = 0
+        # (scheme, netloc) -> list of (connection, last_used)
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _get_connection(self, scheme, netloc):
+        """Return ``(connection, reused)``."""
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get((scheme, netloc), [])
+            while idle:
+                connection, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return connection, True
+                connection.close()
+            self.connections_opened += 1
+        class_ = HTTPSConnection if scheme == 'https' else HTTPConnection
+        return class_(netloc, **get_timeout_kwargs()), False
+
+    def _release(self, scheme, netloc, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_connections:
+                idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def _request(self, url, headers):
+        """Do a single GET request, return ``(response, body)``."""
+        scheme, netloc, path, query, _fragment = urlsplit(url)
+        if query:
+            path += '?' + query
+        headers = dict(headers or {}, **{'User-Agent': VERSION_STRING})
+        while True:
+            connection, reused = self._get_connection(scheme, netloc)
+            try:
+                connection.request('GET', path or '/', headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (HTTPException, IOError):
+                connection.close()
+                if reused:
+                    # The server closed this idle connection, try a new one.
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(scheme, netloc, connection)
+            return response, body
+
+    def request(self, url, headers=None):
+        """Do a GET request for an HTTP or HTTPS URL, following redirects.
+
+        :param headers: a dict of additional request headers.
+        :returns: ``(redirected_url, response, body)``
+        :raises: :class:`HTTPError` for 4xx and 5xx statuses.
+
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            response, body = self._request(url, headers)
+            location = response.getheader('Location')
+            if response.status in REDIRECT_STATUSES and location:
+                url = iri_to_uri(urljoin(url, location))
+            elif response.status >= 400:
+                raise HTTPError(url, response.status, response.reason,
+                                response.msg, None)
+            else:
+                return url, response, body
+        raise HTTPError(url, response.status, 'Too many redirects',
+                        response.msg, None)
+
+    def fetch(self, url):
+        """Fetch an HTTP or HTTPS URL, following redirects.
+
+        :returns: A result dict for an URL fetcher, with the whole body
+                  in ``string``.
+
+        """
+        url, response, body = self.request(url)
+        return make_http_result(url, response, body)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            for idle in self._idle.values():
+                for connection, _last_used in idle:
+                    connection.close()
+            self._idle.clear()
+
+
+def parse_http_date(value):
+    """Return a timestamp from an HTTP date, or ``None``."""
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is not None:
+        return email.utils.mktime_tz(parsed)
+
+
+def get_fresh_until(response, now):
+    """Return the timestamp until which ``response`` can be used without
+    revalidation, or ``None`` if it must not be stored.
+
+    """
+    directives = {}
+    for directive in (response.getheader('Cache-Control') or '').split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives:
+        return None
+    elif 'no-cache' in directives:
+        return now
+    elif 'max-age' in directives:
+        try:
+            return (now + int(directives['max-age'])
+                    - int(response.getheader('Age') or 0))
+        except ValueError:
+            return now
+    expires = response.getheader('Expires')
+    if expires is None:
+        return now
+    expires = parse_http_date(expires)
+    if expires is None:
+        # Invalid dates like "0" mean "already expired"
+        return now
+    date = parse_http_date(response.getheader('Date') or '')
+    return now + expires - (now if date is None else date)
+
+
+class HTTPCache(object):
+    """Keep HTTP responses on disk, to reuse them between documents and
+    processes.
+
+    Responses that are fresh according to their ``Cache-Control`` or
+    ``Expires`` headers are used without any request. Stale responses are
+    revalidated with a conditional request when they have an ``ETag`` or
+    ``Last-Modified`` header.
+
+    :param directory: where responses are stored, created if needed.
+    :param max_size:
+        The maximum total size of the stored responses, in bytes.
+        The least recently used responses are removed first.
+
+    """
+    def __init__(self, directory, max_size=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def _filename(self, url):
+        # Pickled data depends on the version of Python.
+        return os.path.join(self.directory, 'http-py%i-%s.pickle' % (
+            sys.version_info[0], hashlib.sha1(url.encode('utf8')).hexdigest()))
+
+    def fetch(self, url, connection_pool):
+        """Fetch an HTTP or HTTPS URL with ``connection_pool``, or from
+        the cache.
+
+        :returns: A result dict for an URL fetcher.
+
+        """
+        filename = self._filename(url)
+        entry = self._read(filename)
+        now = time.time()
+        headers = {}
+        if entry is not None:
+            if entry['fresh_until'] > now:
+                count('http_cache_hits')
+                self._touch(filename)
+                return dict(entry['result'])
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        redirected_url, response, body = connection_pool.request(url, headers)
+        fresh_until = get_fresh_until(response, now)
+        if response.status == 304 and entry is not None:
+            count('http_cache_revalidations')
+            if fresh_until is not None:
+                entry['fresh_until'] = fresh_until
+                self._write(filename, entry)
+            return dict(entry['result'])
+        result = make_http_result(redirected_url, response, body)
+        etag = response.getheader('ETag')
+        last_modified = response.getheader('Last-Modified')
+        if response.status == 200 and fresh_until is not None and (
+                fresh_until > now or etag or last_modified):
+            self._write(filename, dict(
+                result=result, fresh_until=fresh_until, etag=etag,
+                last_modified=last_modified))
+        return dict(result)
+
+    def _read(self, filename):
+        try:
+            with open(filename, 'rb') as fd:
+                return pickle.load(fd)
+        except Exception:
+            # Missing, unreadable or from an incompatible version
+            return None
+
+    def _touch(self, filename):
+        """Mark a response as recently used."""
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass  # Removed by another thread or process
+
+    def _write(self, filename, entry):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Write to a temporary file first, other processes may be reading.
+            fd, temp_filename = tempfile.mkstemp(dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as file_obj:
+                    pickle.dump(entry, file_obj, pickle.HIGHEST_PROTOCOL)
+                if os.path.exists(filename) and sys.platform == 'win32':
+                    os.remove(filename)
+                os.rename(temp_filename, filename)
+            except Exception:
+                os.remove(temp_filename)
+                raise
+            self._evict()
+        except (IOError, OSError) as exc:
+            LOGGER.warn('Could not write the HTTP cache %s: %s', filename, exc)
+
+    def _evict(self):
+        """Remove the least recently used responses above ``max_size``."""
+        with self._lock:
+            files = []
+            for name in os.listdir(self.directory):
+                if name.startswith('http-') and name.endswith('.pickle'):
+                    filename = os.path.join(self.directory, name)
+                    try:
+                        stat = os.stat(filename)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, filename))
+            total_size = sum(size for _, size, _ in files)
+            for _, size, filename in sorted(files):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                total_size -= size
+
+
+def default_url_fetcher(url, connection_pool=None):
     """Fetch an URL and return dict with the following keys:
 
     * One of ``string`` (a byte string) or ``file_obj`` (a file-like object)
@@ -207,19 +513,65 @@ def default_url_fetcher(url):
     If a ``file_obj`` key is given, it is the caller’s responsability to call
     ``file_obj.close()``.
 
+    HTTP and HTTPS URLs are fetched with ``connection_pool``, or
+    :obj:`CONNECTION_POOL` if it is enabled, unless a proxy is configured.
+    They go through :obj:`HTTP_CACHE` if it is enabled.
+
     """
     if url.startswith('data:'):
         return open_data_url(url)
     elif UNICODE_SCHEME_RE.match(url):
         url = iri_to_uri(url)
+        if connection_pool is None:
+            connection_pool = CONNECTION_POOL
+        scheme = UNICODE_SCHEME_RE.match(url).group(1).lower()
+        if (scheme in ('http', 'https') and scheme not in getproxies() and
+                (connection_pool is not None or HTTP_CACHE is not None)):
+            if connection_pool is None:
+                connection_pool = ConnectionPool()
+            if HTTP_CACHE is not None:
+                return HTTP_CACHE.fetch(url, connection_pool)
+            return connection_pool.fetch(url)
         result, mime_type, charset = urlopen_contenttype(Request(
-            url, headers={'User-Agent': VERSION_STRING}))
+            url, headers={'User-Agent': VERSION_STRING}),
+            **get_timeout_kwargs())
         return dict(file_obj=result, redirected_url=result.geturl(),
                     mime_type=mime_type, encoding=charset)
     else:
         raise ValueError('Not an absolute URI: %r' % url)
 
 
+class FetchBudgetError(IOError):
+    """Raised by fetchers from :func:`limit_fetch_time` once their budget
+    is spent.
+
+    """
+
+
+def limit_fetch_time(url_fetcher, budget):
+    """Wrap ``url_fetcher`` to fail immediately once it has taken
+    ``budget`` seconds in total.
+
+    The time of fetches in parallel threads is added up.
+
+    """
+    lock = threading.Lock()
+    spent = [0]
+
+    def limited_fetcher(url):
+        if spent[0] >= budget:
+            raise FetchBudgetError(
+                'Fetch time budget of %gs spent, not fetching %s'
+                % (budget, url))
+        start = time.time()
+        try:
+            return url_fetcher(url)
+        finally:
+            with lock:
+                spent[0] += time.time() - start
+    return limited_fetcher
+
+
 def wrap_url_fetcher(url_fetcher):
     """Decorate an url_fetcher to fill in optional data.
 
@@ -228,7 +580,8 @@ def wrap_url_fetcher(url_fetcher):
     provided, mime_type is guessed from the path extension in the URL.
 
     """
-    if url_fetcher is None:
+    if url_fetcher is None or url_fetcher is default_url_fetcher:
+        # Its results are already complete.
         return default_url_fetcher
 
     def wrapped_fetcher(url):